@@ -1,26 +1,140 @@
-import json
+import ast
+import binascii
 import os
-from flask import Flask, jsonify, request
+import time
+from flask import Flask, Response, g, jsonify, request
 from model import classify
+from model import settings
+from model import master_data
+from model import warmup
+from model.utils import backbone
+from model.utils import metrics
+from model.utils.image_utils import image_codec
 
 app = Flask(__name__)
 port = int(os.environ.get("PORT", 5000))
 
+# Start sending whatever the outbox still holds from before a restart
+if settings.OUTBOX:
+  classify.get_outbox()
+
+# Load and warm up the detector before /ready lets traffic in
+warmup.start()
+
+# Gauges read when /metrics is scraped
+metrics.Gauge('paintshop_master_data_cache_hit_rate', 'Hit rate of the master data cache.',
+              function=lambda: master_data.stats()['hit_rate'])
+metrics.Gauge('paintshop_load_numbers_in_stock', 'Load numbers fetched ahead of time.',
+              function=lambda: classify.load_numbers.stats()['in_stock'])
+if settings.OUTBOX:
+  metrics.Gauge('paintshop_outbox_depth', 'S4 calls waiting in the outbox.',
+                function=lambda: classify.get_outbox().stats()['depth'])
+  metrics.Gauge('paintshop_outbox_lag_seconds', 'Age of the oldest S4 call in the outbox.',
+                function=lambda: classify.get_outbox().stats()['lag_seconds'])
+  metrics.Gauge('paintshop_outbox_dead', 'S4 calls that failed too often and are no longer retried.',
+                function=lambda: classify.get_outbox().stats()['dead'])
+
+# Request bodies that are the image itself rather than JSON
+IMAGE_MIMETYPES = ('image/jpeg', 'image/png', 'application/octet-stream')
+
+def image_field(value):
+  # Old clients send the repr of the base64 bytes, e.g. "b'/9j/4AAQ...'", which used
+  # to go through eval. literal_eval reads the same literal, escapes included, but
+  # nothing else; a bare base64 string is taken as it is.
+  if not isinstance(value, str):
+    raise ValueError('The image field must be a string, got {}.'.format(type(value).__name__))
+  # Base64 has no quotes, so only a literal starts with one (after an optional b)
+  if value[:1] in ('\'', '"') or (value[:1] in ('b', 'B') and value[1:2] in ('\'', '"')):
+    try:
+      value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+      raise ValueError('The image field is not a valid string or bytes literal.')
+    if not isinstance(value, (str, bytes)):
+      raise ValueError('The image field must be a string or bytes literal.')
+  return value
+
+@app.before_request
+def start_request_metrics():
+  g.request_start = time.perf_counter()
+  metrics.IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+  endpoint = request.endpoint or 'unknown'
+  metrics.REQUESTS.inc(labels=(endpoint, str(response.status_code)))
+  if response.status_code >= 500:
+    metrics.REQUEST_ERRORS.inc(labels=(endpoint,))
+  if 'request_start' in g:
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, (endpoint,))
+  return response
+
+@app.teardown_request
+def end_request_metrics(exception):
+  if 'request_start' in g:
+    metrics.IN_FLIGHT.dec()
+
 @app.route('/')
 def index():
     return "Intelligent Paint Shop Object Detection"
 
+@app.route('/ready')
+def ready():
+  # Readiness for the Cloud Foundry http health check, 503 until warm-up is done
+  status = warmup.status()
+  return jsonify(status), (200 if status['ready'] else 503)
+
 @app.route('/predict', methods = ['GET', 'POST'])
 def predict():
-  data = json.loads(request.get_data())
-  #print(data)
-  if data == None:
-    return 'Got None'
-  else:
-    image = eval(data["image"])
-    prediction = classify.predict(image)
+  imgdata, image = None, None
+  with metrics.timed('body_parse'):
+    # Raw JPEG/PNG upload, as a multipart file or as the whole request body
+    if 'image' in request.files:
+      imgdata = request.files['image'].read()
+    elif request.mimetype in IMAGE_MIMETYPES:
+      imgdata = request.get_data(cache=False)
+    else:
+      # JSON with a base64 encoded image, kept for the old clients
+      data = request.get_json(force=True, silent=True)
+      #print(data)
+      if isinstance(data, dict) and "image" in data:
+        try:
+          image = image_field(data["image"])
+        except ValueError as e:
+          return jsonify({'error': str(e)}), 400
+
+  try:
+    if imgdata is not None:
+      prediction = classify.predict_image(imgdata)
+    elif image is None:
+      return 'Got None'
+    else:
+      prediction = classify.predict(image)
+  except (binascii.Error, image_codec.ImageDecodeError) as e:
+    # A corrupt or non-image upload is the client's fault, not a server error
+    return jsonify({'error': str(e)}), 400
 
   return jsonify(prediction)
 
+@app.route('/stats')
+def stats():
+  # Achieved micro-batch sizes, master data cache hit rates and load number stock
+  return jsonify({
+    'batching': backbone.batch_stats(),
+    'master_data': master_data.stats(),
+    'load_numbers': classify.load_numbers.stats(),
+  })
+
+@app.route('/metrics')
+def metrics_endpoint():
+  # Stage latencies, S4 calls and request counts of this process, Prometheus text format
+  return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/outbox')
+def outbox():
+  # Depth and lag of the S4 outbox
+  if not settings.OUTBOX:
+    return jsonify({})
+  return jsonify(classify.get_outbox().stats())
+
 if __name__ == '__main__':
   app.run(port=port, host='0.0.0.0')
@@ -0,0 +1,97 @@
+"""Import cost of the serving path, per module.
+
+Every module is imported in a fresh interpreter, so nothing is shared between
+measurements. Prints the wall time of each import and, on Python 3.7+ (which
+has -X importtime), the modules that cost the most to import on the way.
+Exits with status 1 if a module imports one of the --forbid packages or takes
+longer than --budget-ms, so a heavyweight import creeping back is caught.
+
+  python -m benchmarks.import_time
+  python -m benchmarks.import_time model.utils.frame_ring --top 20 --budget-ms 500
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules a web worker imports to serve /predict, without the S4 client modules
+SERVING_MODULES = [
+    "model.settings",
+    "model.api.object_counting_api",
+    "model.utils.backbone",
+    "model.utils.frame_ring",
+    "model.nest",
+    "model.outbox",
+]
+
+# Packages the serving path should only import when a feature needs them
+FORBIDDEN = ["tensorflow", "matplotlib", "scipy", "six", "onnxruntime"]
+
+_PROBE = """
+import json, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'modules': sorted(set(sys.modules) - before)}}))
+"""
+
+
+def measure(module):
+    """Wall time and newly imported modules of `import module` in a fresh interpreter."""
+    command = [sys.executable]
+    if sys.version_info >= (3, 7):
+        command += ["-X", "importtime"]
+    command += ["-c", _PROBE.format(module=module)]
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError("import {} failed:\n{}".format(module, process.stderr[-2000:]))
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['breakdown'] = parse_importtime(process.stderr)
+    return result
+
+
+def parse_importtime(stderr):
+    # "import time:   self [us] | cumulative | imported package" lines of -X importtime
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(own), int(cumulative), name.strip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the import cost of the serving modules.")
+    parser.add_argument("modules", nargs="*", default=SERVING_MODULES, help="modules to import")
+    parser.add_argument("--top", type=int, default=10, help="most expensive modules to list per import")
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if an import takes longer")
+    parser.add_argument("--forbid", nargs="*", default=FORBIDDEN, help="packages that must not be imported")
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        result = measure(module)
+        elapsed_ms = 1000 * result['seconds']
+        print("{:<40} {:8.1f} ms  {:4d} modules".format(module, elapsed_ms, len(result['modules'])))
+
+        # Only what this import pulled in, not the interpreter's own start-up
+        imported = set(result['modules'])
+        breakdown = [row for row in result['breakdown'] if row[2] in imported]
+        for own, cumulative, name in sorted(breakdown, reverse=True)[:args.top]:
+            print("    {:>9.1f} ms self {:>9.1f} ms cumulative  {}".format(own / 1000.0, cumulative / 1000.0, name))
+
+        forbidden = sorted(set(name.split(".")[0] for name in result['modules']) & set(args.forbid))
+        if forbidden:
+            failures.append("{} imports {}".format(module, ", ".join(forbidden)))
+        if args.budget_ms is not None and elapsed_ms > args.budget_ms:
+            failures.append("{} takes {:.1f} ms, over the {:.1f} ms budget".format(module, elapsed_ms, args.budget_ms))
+
+    for failure in failures:
+        print("FAIL", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
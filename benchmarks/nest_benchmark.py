@@ -0,0 +1,113 @@
+"""Nest computation: the old DataFrame path against model.nest.
+
+Runs both on the same synthetic material master and detection counts, checks
+that they post byte-identical nest payloads and prints the time per nest.
+
+  python -m benchmarks.nest_benchmark --materials 8 --repeat 2000
+"""
+import argparse
+import collections
+import time
+
+import numpy as np
+import pandas as pd
+
+from model.nest import build_nest
+
+NEST_ID = "0001"
+CDATE = "2020-06-01T10:00:00"
+LOAD_NO = "0000004711"
+NEST_CAPACITY = 26.5
+
+
+class MasterData(object):
+    """Material master frame plus the keys model.master_data.MaterialIndex precomputes."""
+
+    def __init__(self, materials):
+        rng = np.random.RandomState(0)
+        self.frame = pd.DataFrame({
+            "MaterialNo": ["{:018d}".format(1000 + i) for i in range(materials)],
+            "Description": ["Part {}/{}".format(i, materials) for i in range(materials)],
+            "Area": ["{:.3f}".format(a) for a in rng.uniform(0.05, 1.5, materials)],
+            "Color": [("RED", "BLUE")[i % 2] for i in range(materials)],
+        })
+        self.records = self.frame.to_dict('records', into=collections.OrderedDict)
+        self.material_keys = self.frame["MaterialNo"].str.lstrip("0").astype(int).values
+        self.unit_areas = self.frame["Area"].astype(float).values
+
+
+def check_data(mat_data, work_order):
+    # Stand-in for odata.check_data, which is not part of this tree: the parts of
+    # the other colour do not belong to the work order
+    correct = mat_data[mat_data["Color"] == work_order]
+    wrong = mat_data[mat_data["Color"] != work_order]
+    return correct, wrong
+
+
+def dataframe_nest(master, mat, work_order, class_names):
+    # The per-request DataFrame path classify.predict used before model.nest
+    mat_data = master.frame[np.isin(master.material_keys, list(mat.keys()))].copy()
+    mat_data["Qty"] = mat_data["MaterialNo"].str.lstrip("0").astype(int).map(mat)
+    mat_data["Area"] = (mat_data["Area"].astype(float) * mat_data["Qty"]).round(3)
+    mat_data["Area"] = mat_data["Area"].astype(str)
+    mat_data['Qty'] = mat_data['Qty'].astype(str)
+    mat_data.insert(0, 'LoadNo', LOAD_NO)
+    mat_data.insert(1, 'NestId', NEST_ID)
+    mat_data.insert(2, 'Cdate', CDATE)
+
+    Total_Area = mat_data["Area"].astype(float).sum().round(2)
+    T_Area = (Total_Area/NEST_CAPACITY * 100).round(2)
+    correct, wrong = check_data(mat_data, work_order)
+
+    targets = [name for name, key in class_names if (wrong["MaterialNo"].str.lstrip("0").astype(int) == key).any()]
+    final = (correct if wrong.empty else mat_data).to_json(orient='records')
+    final = final.replace("[",'{"MaterialNo": "000000","Area": "","Color": "","ZDetailToItem": [').replace("]","]}")
+    return final, Total_Area, T_Area, targets
+
+
+def engine_nest(master, mat, work_order, class_names):
+    nest = build_nest(master, mat, LOAD_NO, NEST_ID, CDATE)
+    Total_Area = nest.total_area
+    T_Area = nest.loading_level(NEST_CAPACITY)
+    correct, wrong = nest.partition(nest.correct_keys(lambda frame: check_data(frame, work_order)))
+
+    wrong_keys = set(item.material_key for item in wrong.items)
+    targets = [name for name, key in class_names if key in wrong_keys]
+    final = (correct if wrong.empty else nest).payload()
+    return final, Total_Area, T_Area, targets
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the nest engine against the DataFrame path.")
+    parser.add_argument("--materials", type=int, default=8, help="part materials in the material master")
+    parser.add_argument("--repeat", type=int, default=2000, help="nests per measurement")
+    parser.add_argument("--work-order", default="RED", help="colour the stand-in check_data accepts")
+    args = parser.parse_args()
+
+    master = MasterData(args.materials)
+    rng = np.random.RandomState(1)
+    keys = master.material_keys.tolist()
+    mat = dict((key, int(rng.randint(1, 6))) for key in keys[::2] + keys[1:3])
+    class_names = [("part_{}".format(key), key) for key in mat]
+
+    old, old_time = timed(lambda: dataframe_nest(master, mat, args.work_order, class_names), args.repeat)
+    new, new_time = timed(lambda: engine_nest(master, mat, args.work_order, class_names), args.repeat)
+
+    assert old[0] == new[0], "payloads differ:\n{}\n{}".format(old[0], new[0])
+    assert old[1] == new[1] and old[2] == new[2], "areas differ: {} {}".format(old[1:3], new[1:3])
+    assert old[3] == new[3], "targets differ: {} {}".format(old[3], new[3])
+
+    print("{} line items, {} wrong".format(len(mat), len(new[3])))
+    print("DataFrame path: {:8.1f} us/nest".format(old_time * 1e6))
+    print("Nest engine:    {:8.1f} us/nest ({:.0f}x)".format(new_time * 1e6, old_time / new_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""gunicorn settings for serving app:app with preforked workers.
+
+  gunicorn --config gunicorn.conf.py app:app
+
+Each worker loads its own copy of the model after the fork and gets an equal
+share of the instance's cores for its inference thread pools. The number of
+workers follows from the CPUs and the Cloud Foundry MEMORY_LIMIT, unless
+WEB_CONCURRENCY sets it:
+
+  WEB_CONCURRENCY      worker processes (default: sized from CPU and memory)
+  WEB_THREADS          request threads per worker, their inferences are batched
+  WORKER_MEMORY_MB     memory one worker needs with the model loaded
+  RESERVED_MEMORY_MB   memory kept free for everything else in the container
+  CPU_AFFINITY         "1" pins each worker to its own share of the cores
+
+With INFERENCE_SERVER=1 the master starts one inference process before
+forking the workers instead; the workers only handle HTTP and hand their
+frames to it through shared memory. A supervisor process restarts it if it
+dies, and /ready reports 503 until it serves again. Workers are then sized with
+WORKER_MEMORY_MB defaulting to 256, after INFERENCE_MEMORY_MB for the model.
+"""
+import itertools
+import os
+
+
+def _memory_limit_mb():
+    # Cloud Foundry sets MEMORY_LIMIT to the instance quota, e.g. "4096m" or "4G"
+    limit = os.environ.get("MEMORY_LIMIT", "").strip().lower()
+    if not limit:
+        return None
+    units = {"k": 1.0 / 1024, "m": 1.0, "g": 1024.0}
+    if limit[-1] in units:
+        return int(float(limit[:-1]) * units[limit[-1]])
+    return int(float(limit) / (1024 * 1024))
+
+
+def _cpus():
+    # Cores this container may run on, not all cores of the host
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _workers(cpus):
+    if os.environ.get("WEB_CONCURRENCY"):
+        return int(os.environ["WEB_CONCURRENCY"])
+    workers = cpus
+    memory = _memory_limit_mb()
+    if memory is not None:
+        reserved = int(os.environ.get("RESERVED_MEMORY_MB", 512))
+        if inference_server:
+            reserved += int(os.environ.get("INFERENCE_MEMORY_MB", 1024))
+        per_worker = int(os.environ.get("WORKER_MEMORY_MB", 256 if inference_server else 1024))
+        workers = min(workers, (memory - reserved) // per_worker)
+    return max(1, workers)
+
+
+inference_server = os.environ.get("INFERENCE_SERVER", "0") == "1"
+cpus = _cpus()
+bind = "0.0.0.0:{}".format(os.environ.get("PORT", 5000))
+workers = _workers(cpus)
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 4))
+
+# The model is loaded after the fork, not in the master
+preload_app = False
+# Loading and warming up the model counts against the boot timeout
+timeout = int(os.environ.get("WORKER_TIMEOUT", 180))
+graceful_timeout = 30
+
+accesslog = "-"
+errorlog = "-"
+
+cores_per_worker = max(1, cpus // workers)
+
+
+def on_starting(server):
+    # The shared inference process and its frame ring must exist before the workers fork
+    if inference_server:
+        from model.utils import frame_ring
+        frame_ring.start_server()
+        server.log.info("Started the inference process and its supervisor")
+
+
+def pre_fork(server, worker):
+    # Lowest slot no live worker holds, so a replacement takes over its cores
+    used = set(getattr(other, "slot", None) for other in server.WORKERS.values())
+    worker.slot = next(slot for slot in itertools.count() if slot not in used)
+
+
+def post_fork(server, worker):
+    # Runs in the new worker before the app is imported, so model.settings
+    # picks up this worker's thread counts from the environment
+    os.environ.setdefault("INFERENCE_THREADS", str(cores_per_worker))
+    os.environ.setdefault("INFERENCE_INTER_OP_THREADS", "1")
+
+    if os.environ.get("CPU_AFFINITY", "0") == "1" and hasattr(os, "sched_setaffinity"):
+        available = sorted(os.sched_getaffinity(0))
+        slot = worker.slot % workers
+        cores = available[slot * cores_per_worker:(slot + 1) * cores_per_worker] or available
+        os.sched_setaffinity(0, cores)
+        server.log.info("Worker %s pinned to cores %s", worker.pid, cores)
+
+
+def post_worker_init(worker):
+    # The app started warming up on import, accept requests only once it is done
+    from model import settings
+    from model import warmup
+
+    if warmup.wait():
+        worker.log.info("Worker %s ready, warm-up took %.2f s with %s intra-op threads",
+                        worker.pid, warmup.status()['warmup_seconds'], settings.INFERENCE_THREADS)
+    elif settings.INFERENCE_SERVER:
+        worker.log.warning("Worker %s waiting for the inference process: %s", worker.pid, warmup.status()['error'])
+    else:
+        worker.log.error("Worker %s warm-up failed: %s", worker.pid, warmup.status()['error'])
@@ -0,0 +1,84 @@
+import collections
+import copy
+import numpy as np
+
+
+class DetectionResult(object):
+    """Detections of one image that pass the score threshold, with per-class counts.
+
+    Only the first `max_boxes` detections are considered (the detector returns
+    them sorted by score) and of those only the ones scoring above
+    `min_score_thresh`, the same selection the visualization uses for drawing.
+
+    Boxes are normalized, so they place the same on the frame the detector saw
+    and on the full-resolution original used for annotation.
+
+    Attributes:
+      image: the unannotated frame the detections belong to.
+      boxes: float array [N, 4] of normalized (ymin, xmin, ymax, xmax).
+      scores: float array [N].
+      classes: int32 array [N] of 1-based class ids.
+      category_index: dict of category dicts keyed by class id.
+      class_counts: int array, number of detections per class id.
+      colors: recognised colour name per box, or None when colour
+        recognition is off.
+    """
+
+    def __init__(self, image, boxes, scores, classes, category_index, min_score_thresh=.8, max_boxes=20, original=None):
+        mask = scores[:max_boxes] > min_score_thresh
+        self.image = image
+        self._original = original
+        self.boxes = boxes[:max_boxes][mask]
+        self.scores = scores[:max_boxes][mask]
+        self.classes = classes[:max_boxes][mask].astype(np.int32)
+        self.category_index = category_index
+        self.class_counts = np.bincount(self.classes, minlength=max(category_index.keys()) + 1)
+        self.colors = None
+
+    def class_name(self, class_id):
+        if class_id in self.category_index:
+            return self.category_index[class_id]['name']
+        return 'N/A'
+
+    def select(self, class_ids):
+        """The detections of the given class ids only, as a new DetectionResult."""
+        mask = np.isin(self.classes, np.fromiter(class_ids, dtype=np.int32))
+        selected = copy.copy(self)
+        selected.boxes = self.boxes[mask]
+        selected.scores = self.scores[mask]
+        selected.classes = self.classes[mask]
+        selected.class_counts = np.bincount(selected.classes, minlength=len(self.class_counts))
+        if self.colors is not None:
+            selected.colors = [color for color, keep in zip(self.colors, mask.tolist()) if keep]
+        return selected
+
+    def annotation_frame(self):
+        """A fresh copy of the frame to draw on, the full-resolution original when there is one."""
+        if self._original is not None:
+            return self._original()
+        return self.image.copy()
+
+    def crops(self):
+        """Pixel crop of `image` for every box, cut the way the drawing code cuts them."""
+        height, width = self.image.shape[:2]
+        crops = []
+        for ymin, xmin, ymax, xmax in self.boxes.tolist():
+            top, bottom = int(ymin * height), int(ymax * height)
+            left, right = int(xmin * width), int(xmax * width)
+            crops.append(self.image[top:max(bottom, top + 1), left:max(right, left + 1)])
+        return crops
+
+    @property
+    def counts(self):
+        """Ordered dict of class name -> count, in order of first (highest scoring) appearance."""
+        class_ids, first_seen = np.unique(self.classes, return_index=True)
+        counts = collections.OrderedDict()
+        for class_id in class_ids[np.argsort(first_seen)]:
+            name = self.class_name(int(class_id))
+            counts[name] = counts.get(name, 0) + int(self.class_counts[class_id])
+        return counts
+
+    @property
+    def counting_mode(self):
+        """The counts in the "'name': count, ..." text form clients already receive."""
+        return ', '.join("'{}': {}".format(name, count) for name, count in self.counts.items())
@@ -1,115 +1,91 @@
-import tensorflow as tf
-import cv2
-import numpy as np
+import threading
 from model.utils import visualization_utils as vis_util
-
-def single_image_object_counting(input_video, detection_graph, category_index, is_color_recognition_enabled, fps, width, height):     
-         
-    counting_mode = "..."
-    with detection_graph.as_default():
-        with tf.Session(graph=detection_graph) as sess:
-            # Definite input and output Tensors for detection_graph
-            image_tensor = detection_graph.get_tensor_by_name('image_tensor:0')
-
-            # Each box represents a part of the image where a particular object was detected.
-            detection_boxes = detection_graph.get_tensor_by_name('detection_boxes:0')
-
-            # Each score represent how level of confidence for each of the objects.
-            # Score is shown on the result image, together with the class label.
-            detection_scores = detection_graph.get_tensor_by_name('detection_scores:0')
-            detection_classes = detection_graph.get_tensor_by_name('detection_classes:0')
-            num_detections = detection_graph.get_tensor_by_name('num_detections:0')            
-
-        
-
-            input_frame = cv2.imread(input_video)
-
-            # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
-            image_np_expanded = np.expand_dims(input_frame, axis=0)
-
-            # Actual detection.
-            (boxes, scores, classes, num) = sess.run(
-            [detection_boxes, detection_scores, detection_classes, num_detections],
-            feed_dict={image_tensor: image_np_expanded})
-
-    # insert information text to video frame
-    font = cv2.FONT_HERSHEY_SIMPLEX
-
-    # Visualization of the results of a detection.        
-    counter, csv_line, counting_mode = vis_util.visualize_boxes_and_labels_on_single_image_array(1,input_frame,
-                                                                                              1,
-                                                                                              is_color_recognition_enabled,
-                                                                                              np.squeeze(boxes),
-                                                                                              np.squeeze(classes).astype(np.int32),
-                                                                                              np.squeeze(scores),
-                                                                                              category_index,
-                                                                                              use_normalized_coordinates=True,
-                                                                                              line_thickness=4,
-                                                                                              min_score_thresh=.8)
-        
-    #  To print results with labelled image
+from model.utils.image_utils import image_codec
+from model.api.detection_result import DetectionResult
+from model.utils import metrics
+
+class Annotation(object):
+    """Annotated copy of a frame, rendered the first time it is asked for.
+
+    The counts are all the correct/wrong decision needs, so drawing is left
+    until posting actually wants the image, possibly on another thread.
+    """
+
+    def __init__(self, render):
+        self._render = render
+        self._frame = None
+        self._lock = threading.Lock()
+
+    def frame(self):
+        with self._lock:
+            if self._frame is None:
+                self._frame = self._render()
+        return self._frame
+
+    def jpeg(self):
+        frame = self.frame()
+        with metrics.timed("annotation_encode"):
+            return image_codec.encode_image(frame)
+
+def single_image_object_counting(input_frame, detection_model, is_color_recognition_enabled, fps, width, height, original=None):
+
+    # Downscale to the model input size, the boxes are normalized so they still fit the original
+    if width and height:
+        full_frame = input_frame
+        with metrics.timed("resize"):
+            input_frame = image_codec.fit_image(full_frame, width, height)
+        if original is None and input_frame is not full_frame:
+            original = full_frame.copy
+
+    # Actual detection, on the process-wide session.
+    with metrics.timed("inference"):
+        (boxes, scores, classes, num) = detection_model.detect(input_frame)
+
+    # Filtered detections and per-class counts, kept so the wrong-part
+    # highlighting can be rendered without running the model again.
+    # `original` returns the full-resolution frame to annotate, if input_frame is reduced.
+    with metrics.timed("postprocess"):
+        result = DetectionResult(input_frame, boxes, scores, classes, detection_model.category_index, min_score_thresh=.8, original=original)
+
+    # Colour of all detected objects in one batch
+    if is_color_recognition_enabled:
+        # Only loaded when colour recognition is switched on
+        from model.utils.color_recognition_module import color_recognition_api
+        with metrics.timed("color_recognition"):
+            result.colors = color_recognition_api.color_recognition_batch(result.crops())
+
+    #  To print results
     print ("\nFound Following objects in image:\n")
-    print(counting_mode)
-                        
-    # Added to save the labelled image
-    img_name = "./model/output_images/image.jpg"
-    cv2.imwrite(img_name, input_frame)
-    print("Image Saved")
-            
-    return counting_mode       
-
-def single_image_target_counting(input_video, detection_graph, category_index, is_color_recognition_enabled,targeted_object, fps, width, height):     
-         
-    counting_mode = "..."
-
-    with detection_graph.as_default():
-        with tf.Session(graph=detection_graph) as sess:
-            # Definite input and output Tensors for detection_graph
-            image_tensor = detection_graph.get_tensor_by_name('image_tensor:0')
-
-            # Each box represents a part of the image where a particular object was detected.
-            detection_boxes = detection_graph.get_tensor_by_name('detection_boxes:0')
-
-            # Each score represent how level of confidence for each of the objects.
-            # Score is shown on the result image, together with the class label.
-            detection_scores = detection_graph.get_tensor_by_name('detection_scores:0')
-            detection_classes = detection_graph.get_tensor_by_name('detection_classes:0')
-            num_detections = detection_graph.get_tensor_by_name('num_detections:0')            
-
-        
-            input_frame = cv2.imread(input_video)
-
-            # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
-            image_np_expanded = np.expand_dims(input_frame, axis=0)
-
-            # Actual detection.
-            (boxes, scores, classes, num) = sess.run(
-            [detection_boxes, detection_scores, detection_classes, num_detections],
-            feed_dict={image_tensor: image_np_expanded})
-
-    # insert information text to video frame
-    font = cv2.FONT_HERSHEY_SIMPLEX
-
-    # Visualization of the results of a detection.        
-    counter, csv_line, counting_mode = vis_util.visualize_boxes_and_labels_on_target_image_array(1,input_frame,
-                                                                                              1,
-                                                                                              is_color_recognition_enabled,
-                                                                                              np.squeeze(boxes),
-                                                                                              np.squeeze(classes).astype(np.int32),
-                                                                                              np.squeeze(scores),
-                                                                                              category_index,
-                                                                                              targeted_objects=targeted_object,
-                                                                                              use_normalized_coordinates=True,
-                                                                                              line_thickness=4,
-                                                                                              min_score_thresh=.8)
-        
-    #  To print results with labelled image
+    print(result.counting_mode)
+
+    return result, Annotation(lambda: render_objects(result))
+
+def render_objects(result):
+    # Visualization of the results of a detection, on a copy so result.image stays clean
+    with metrics.timed("annotation_frame"):
+        output_frame = result.annotation_frame()
+    render_time = vis_util.visualize_detections_on_image_array(output_frame,
+                                                               result.boxes,
+                                                               result.classes,
+                                                               result.scores,
+                                                               result.category_index,
+                                                               color_names=result.colors,
+                                                               use_normalized_coordinates=True,
+                                                               line_thickness=4)
+    metrics.STAGE_SECONDS.observe(render_time, ("render",))
+    print("Rendered in {:.1f} ms".format(render_time * 1000))
+
+    return output_frame
+
+def single_image_target_counting(result, is_color_recognition_enabled, target_classes, fps, width, height):
+
+    # Detections of the targeted class ids only, from the first detection pass
+    targets = result.select(target_classes)
+    counting_mode = targets.counting_mode
+
+    #  To print results
     print ("\nFound Following objects in image:\n")
     print(counting_mode)
-        
-    # Added to save the labelled image
-    img_name = "./model/output_images/wrong_image.jpg"
-    cv2.imwrite(img_name, input_frame)
-    print("Image Saved")
-            
-    return counting_mode, input_frame
\ No newline at end of file
+
+    # Only the targeted boxes are drawn, colours come from the first pass
+    return counting_mode, Annotation(lambda: render_objects(targets))
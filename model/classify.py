@@ -1,21 +1,30 @@
-import tensorflow as tf
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pytz
 
 # Object detection imports
 from model.utils import backbone
+from model.utils import frame_ring
 from model.api import object_counting_api
+from model.utils.image_utils import image_codec
+from model.utils import metrics
 
 # Custom imports
 import model.odata_call as odata
 import model.get_config as config
+from model import settings
+from model.outbox import Outbox
+from model.load_numbers import LoadNumberAllocator
+from model import master_data
+from model.nest import build_nest
 
 # Initializing Variables for inference
 fps = 30 # change it with your input fps
-width = 640 # change it with your input width
-height = 480 # change it with your input height
-is_color_recognition_enabled = 0
+width = settings.INPUT_WIDTH # change it with your input width
+height = settings.INPUT_HEIGHT # change it with your input height
+is_color_recognition_enabled = int(settings.COLOR_RECOGNITION)
 
 # Initializing Variables
 WorkOrder = "RED"
@@ -26,90 +35,153 @@ Underload = config.get_load("Underload")
 Overload = config.get_load("Overload")
 Nest_Capacity = config.get_load("Nest_Capacity")
 
-def predict(image_string):
-    # Get the Load No
-    LoadNo = odata.get_load_no()
+# Renders the annotated image and posts to S4 after the response has gone out
+background = ThreadPoolExecutor(max_workers=1)
+background_slots = threading.BoundedSemaphore(settings.BACKGROUND_QUEUE_SIZE)
+
+# Issues the independent S4 calls of a load concurrently
+s4_calls = ThreadPoolExecutor(max_workers=settings.S4_CONCURRENCY)
+
+# S4 call of each kind of posting, used directly and by the outbox sender
+S4_CALLS = {
+    "nest": metrics.timed_call("nest", odata.post_data),
+    "consumption": metrics.timed_call("consumption", odata.post_consump),
+    "image": metrics.timed_call("image", odata.post_image),
+}
 
-    # Read the image_data
-    imgdata = base64.b64decode(image_string)
-    with open('./model/images/image.jpg', 'wb') as f:
-        f.write(imgdata)
+# Load numbers, reserved at the start of a request
+load_numbers = LoadNumberAllocator(odata.get_load_no, settings.LOAD_NO_PREFETCH)
 
-    # Input Image
-    image_data = "./model/images/image.jpg"
+# Durable queue of S4 calls, see get_outbox
+outbox = None
+outbox_lock = threading.Lock()
 
-    detection_graph, category_index = backbone.set_model('./model/inference_graph')
-    print(detection_graph,category_index)
+def predict(image_string):
+    # Base64 encoded image, as sent by the JSON clients
+    with metrics.timed("base64_decode"):
+        imgdata = base64.b64decode(image_string)
+    return predict_image(imgdata)
+
+def predict_image(imgdata):
+    # Decode the raw JPEG/PNG bytes in memory, no shared temp files between requests.
+    # When annotation runs on the background worker, JPEGs are decoded at reduced
+    # resolution here and the full one is only decoded there. Otherwise every load
+    # is annotated on this thread anyway, so one full decode is downscaled instead.
+    with metrics.timed("image_decode"):
+        original = None
+        if settings.ANNOTATE_IN_BACKGROUND:
+            input_frame = image_codec.decode_image(imgdata, width, height)
+            if input_frame.shape[1::-1] != image_codec.image_size(imgdata):
+                original = lambda: image_codec.decode_image(imgdata)
+        else:
+            input_frame = image_codec.decode_image(imgdata)
+
+    # Reserve the Load No only for an image that decoded, fetched while it is inferred
+    load_no = load_numbers.reserve()
+
+    # Loaded once per process, concurrent requests share batched sess.run calls,
+    # or run by the inference process all workers share
+    if settings.INFERENCE_SERVER:
+        detection_model = frame_ring.get_client()
+    else:
+        detection_model = backbone.get_batched_model(settings.MODEL_DIR, settings.BATCH_WINDOW_MS, settings.MAX_BATCH_SIZE)
 
     # TensorFlow Inference
-    result = object_counting_api.single_image_object_counting(image_data, detection_graph, category_index, is_color_recognition_enabled, fps, width, height)
-    #print (result)
+    detection, annotation = object_counting_api.single_image_object_counting(input_frame, detection_model, is_color_recognition_enabled, fps, width, height, original)
+    result = detection.counting_mode
 
-    # Getting the Material Number from material config file 
-    mat = odata.get_material_no(result)
+    # Getting the Material Number from the cached class id -> material index
+    with metrics.timed("material_lookup"):
+        index = master_data.material_index(detection.category_index)
+        mat = index.quantities(detection.class_counts)
     print(mat)
 
-    # Getting the Material Data from Material Master
-    mat_data = odata.material_data(' or '.join("{!s}".format(key) for (key) in mat.keys()))
+    with metrics.timed("load_no_wait"):
+        LoadNo = load_no.result()
 
-    # Adding Quantity to the dataframe
-    mat_data["Qty"] = mat_data["MaterialNo"].str.lstrip("0").astype(int).map(mat)
-    mat_data["Area"] = (mat_data["Area"].astype(float) * mat_data["Qty"]).round(3)
-    mat_data["Area"] = mat_data["Area"].astype(str)
-    mat_data['Qty'] = mat_data['Qty'].astype(str)
-    mat_data.insert(0, 'LoadNo', LoadNo)
-    mat_data.insert(1, 'NestId', NestId)
-    currDate = datetime.now(pytz.utc).astimezone(pytz.timezone('US/Eastern'))
-    mat_data.insert(2, 'Cdate', currDate.strftime('%Y-%m-%dT%H:%M:%S'))
+    # Nest line items from the cached Material Master
+    with metrics.timed("nest"):
+        currDate = datetime.now(pytz.utc).astimezone(pytz.timezone('US/Eastern'))
+        nest = build_nest(index, mat, LoadNo, NestId, currDate.strftime('%Y-%m-%dT%H:%M:%S'))
 
-    print("\nNest Details:\n", mat_data)
+        Total_Area = nest.total_area
+        T_Area = nest.loading_level(Nest_Capacity)
 
-    Total_Area = mat_data["Area"].astype(float).sum().round(2)
-    T_Area = (Total_Area/Nest_Capacity * 100).round(2)
-    print("\nCurrent Nest Loading Level: ", T_Area,"%")
+    # Work order check on the real rows of this nest, then nests of correct and wrong parts
+    with metrics.timed("work_order_check"):
+        correct, wrong = nest.partition(nest.correct_keys(lambda frame: odata.check_data(frame, WorkOrder)))
 
-    # Datafram for correct and wrong parts
-    correct, wrong = odata.check_data(mat_data, WorkOrder)
+    print("\nNest Details:\n", nest)
+    print("\nCurrent Nest Loading Level: ", T_Area,"%")
 
     # Posting in S4 if correct / Showing part in case of wrong
     if wrong.empty:
-        image = "./model/output_images/image.jpg"
-
-        posting(correct, Total_Area, currDate, image, LoadNo)
+        submit_posting(correct, Total_Area, currDate, annotation, LoadNo)
 
     else:
-        # To show the wrong parts    
-        temp = "{" + result + "}"
-        temp = eval(temp)
-        list_target = []
-        for k, v in temp.items():
-            if (wrong["MaterialNo"].str.lstrip("0").astype(int) == config.get_material(k)).any():
-                list_target.append(k)
-        targeted_objects = ', '.join(list_target)
+        # Class ids of the wrong parts, to show them
+        target_classes = index.class_ids(item.material_key for item in wrong.items)
 
         print("\nRemove these objects:\n")
-        result, image = object_counting_api.single_image_target_counting(image_data, detection_graph, category_index, is_color_recognition_enabled, targeted_objects, fps, width, height) # targeted objects counting
-        
-        image = "./model/output_images/wrong_image.jpg"
+        result, annotation = object_counting_api.single_image_target_counting(detection, is_color_recognition_enabled, target_classes, fps, width, height) # targeted objects counting, reusing the first pass
 
-        posting(mat_data, Total_Area, currDate, image, LoadNo)
+        submit_posting(nest, Total_Area, currDate, annotation, LoadNo)
 
     return(result)
 
-def posting(mat_tab, Total_Area, currDate, image, LoadNo):
-        
-        final = mat_tab.to_json(orient='records')
-        final = final.replace("[",'{"MaterialNo": "000000","Area": "","Color": "","ZDetailToItem": [').replace("]","]}")
-        print(final)
+def submit_posting(nest, Total_Area, currDate, annotation, LoadNo):
+    # Through the outbox the load is only recorded here and sent to S4 later
+    deliver = record_posting if settings.OUTBOX else posting
+    # The annotated image is only rendered once posting asks for it
+    if settings.ANNOTATE_IN_BACKGROUND:
+        # Bounded, as every queued load keeps its full-resolution upload in memory
+        with metrics.timed("background_queue_wait"):
+            background_slots.acquire()
+        try:
+            future = background.submit(deliver, nest, Total_Area, currDate, annotation, LoadNo)
+        except Exception:
+            background_slots.release()
+            raise
+        future.add_done_callback(report_posting_error)
+    else:
+        deliver(nest, Total_Area, currDate, annotation, LoadNo)
+
+def report_posting_error(future):
+    background_slots.release()
+    if future.exception() is not None:
+        print("Posting of load failed:", repr(future.exception()))
+
+def get_outbox():
+    # Opened on first use, so every worker process gets its own connection and sender
+    global outbox
+    with outbox_lock:
+        if outbox is None:
+            outbox = Outbox(settings.OUTBOX_PATH, S4_CALLS, max_workers=settings.S4_CONCURRENCY,
+                            max_attempts=settings.OUTBOX_MAX_ATTEMPTS)
+            outbox.start()
+    return outbox
+
+def record_posting(nest, Total_Area, currDate, annotation, LoadNo):
+    calls = list(posting_calls(nest, Total_Area, currDate, annotation, LoadNo))
+    with metrics.timed("outbox_enqueue"):
+        get_outbox().enqueue(LoadNo, calls)
+
+def posting(nest, Total_Area, currDate, annotation, LoadNo):
+        # The S4 calls do not depend on each other, so they are all in flight together
+        calls = [s4_calls.submit(S4_CALLS[kind], *args) for kind, args in posting_calls(nest, Total_Area, currDate, annotation, LoadNo)]
         
-        #Converting Image from JPG to base64 and sending to S4 in Binary format
-        image = odata.convert_image(image)
+        # Wait for all of them, the first failure is raised
+        for call in calls:
+            call.result()
+
+def posting_calls(nest, Total_Area, currDate, annotation, LoadNo):
+        # Yields the (kind, args) S4 calls of a load, the image last so it can render while the others are sent
         
-        # For posting image in S4
-        odata.post_image("", "", image, "")
+        final = nest.payload()
+        print(final)
         
         # For posting Nest data in S4
-        odata.post_data(final)
+        yield "nest", [final]
         
         # For posting Consumption data in S4
         Energy_Target = config.get_consump("Energy_Target")
@@ -139,6 +211,11 @@ def posting(mat_tab, Total_Area, currDate, image, LoadNo):
         Actual_Energy = str(Actual_Energy)
         Actual_Propene = str(Actual_Propene)
         
-        odata.post_consump(Date, Time, LoadNo, "ENERGY", Total_Area, Targetted_Energy, Actual_Energy)
-        odata.post_consump(Date, Time, LoadNo, "PROPENE", Total_Area, Targetted_Propene, Actual_Propene)
-        
\ No newline at end of file
+        yield "consumption", [Date, Time, LoadNo, "ENERGY", Total_Area, Targetted_Energy, Actual_Energy]
+        yield "consumption", [Date, Time, LoadNo, "PROPENE", Total_Area, Targetted_Propene, Actual_Propene]
+        
+        #Rendering the annotated JPG, converting it to base64 and sending to S4 in Binary format
+        image = base64.b64encode(annotation.jpeg()).decode('utf-8')
+        
+        # For posting image in S4
+        yield "image", ["", "", image, ""]
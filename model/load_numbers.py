@@ -0,0 +1,75 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class LoadNumberAllocator(object):
+    """Hands out load numbers without a blocking S4 round-trip at request start.
+
+    `reserve()` returns a future for the next load number. With `prefetch` > 0
+    a background thread keeps up to that many numbers fetched ahead of time and
+    a reservation is served from that stock. This assumes `fetch` reserves the
+    number it returns on the S4 side, and numbers still in stock when the
+    process stops are skipped. With `prefetch` = 0, or when the stock is empty,
+    the fetch is started on a thread of its own so it runs while the detector
+    runs; only `result()` on the future waits for it.
+    Concurrent requests never queue behind each other's fetches.
+    """
+
+    def __init__(self, fetch, prefetch=0, retry_interval=5.0):
+        self.fetch = fetch
+        self.prefetch = prefetch
+        self.retry_interval = retry_interval
+
+        self._stock = queue.Queue()
+        self._refill = threading.Event()
+        self._lock = threading.Lock()
+        self._filler = None
+
+    def reserve(self):
+        if self.prefetch > 0:
+            self._start_filler()
+            self._refill.set()
+            try:
+                future = Future()
+                future.set_result(self._stock.get_nowait())
+                return future
+            except queue.Empty:
+                pass
+        return self._fetch_async()
+
+    def stats(self):
+        return {'prefetch': self.prefetch, 'in_stock': self._stock.qsize()}
+
+    def _fetch_async(self):
+        future = Future()
+
+        def fetch():
+            try:
+                future.set_result(self.fetch())
+            except Exception as e:
+                future.set_exception(e)
+
+        thread = threading.Thread(target=fetch, name='load-number-fetch')
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def _start_filler(self):
+        with self._lock:
+            if self._filler is None:
+                self._filler = threading.Thread(target=self._fill, name='load-number-prefetch')
+                self._filler.daemon = True
+                self._filler.start()
+
+    def _fill(self):
+        while True:
+            self._refill.clear()
+            while self._stock.qsize() < self.prefetch:
+                try:
+                    self._stock.put(self.fetch())
+                except Exception as e:
+                    print("Prefetching load number failed:", repr(e))
+                    time.sleep(self.retry_interval)
+            self._refill.wait()
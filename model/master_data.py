@@ -0,0 +1,65 @@
+import collections
+import numpy as np
+
+# Custom imports
+import model.odata_call as odata
+import model.get_config as config
+from model import settings
+from model.utils.ttl_cache import TTLCache
+
+# Material numbers and material master rows of the part classes hardly ever
+# change, so they are fetched once and reused until the TTL runs out
+cache = TTLCache(maxsize=settings.MASTER_DATA_CACHE_SIZE, ttl=settings.MASTER_DATA_TTL)
+
+def material_no(class_name):
+    # Material number of a detected class, from the material config file
+    return cache.get(("material_no", class_name), lambda: int(config.get_material(class_name)))
+
+class MaterialIndex(object):
+    """Material master of all part classes, indexed by class id.
+
+    Attributes:
+      material_by_class: int array, material number for each class id
+        (0 for ids without a category).
+      frame: the material master rows of all part materials, as returned by
+        odata.material_data.
+      records: the rows of `frame` as ordered dicts.
+      material_keys: int array, MaterialNo of each row of `frame` with the
+        leading zeros stripped.
+      unit_areas: float array, Area of each row of `frame`.
+      area_by_class: float array, unit area for each class id.
+    """
+
+    def __init__(self, category_index):
+        size = max(category_index.keys()) + 1
+        self.material_by_class = np.zeros(size, dtype=np.int64)
+        for class_id, category in category_index.items():
+            self.material_by_class[class_id] = material_no(category['name'])
+
+        materials = sorted(set(self.material_by_class[self.material_by_class > 0].tolist()))
+        self.frame = odata.material_data(' or '.join("{!s}".format(key) for key in materials))
+        self.records = self.frame.to_dict('records', into=collections.OrderedDict)
+        self.material_keys = self.frame["MaterialNo"].str.lstrip("0").astype(int).values
+        self.unit_areas = self.frame["Area"].astype(float).values
+
+        areas = dict(zip(self.material_keys.tolist(), self.unit_areas.tolist()))
+        self.area_by_class = np.array([areas.get(m, 0.0) for m in self.material_by_class.tolist()])
+
+    def quantities(self, class_counts):
+        # Material number -> quantity, from the per-class counts of a detection
+        mat = {}
+        for class_id in np.nonzero(class_counts[:len(self.material_by_class)])[0]:
+            material = int(self.material_by_class[class_id])
+            mat[material] = mat.get(material, 0) + int(class_counts[class_id])
+        return mat
+
+    def class_ids(self, materials):
+        # Class ids of the part classes made of one of `materials`
+        return np.nonzero(np.isin(self.material_by_class, list(materials)))[0]
+
+def material_index(category_index):
+    key = ("material_index",) + tuple(sorted(category_index))
+    return cache.get(key, lambda: MaterialIndex(category_index))
+
+def stats():
+    return cache.stats()
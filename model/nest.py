@@ -0,0 +1,94 @@
+import collections
+import json
+import numpy as np
+
+
+class LineItem(object):
+    """One material of a nest: its material master fields, quantity and area.
+
+    Attributes:
+      material_key: MaterialNo as an int, without the leading zeros.
+      qty: number of detected parts of this material.
+      area: unit area times qty, rounded to 3 decimals.
+      fields: ordered material master fields of the material.
+    """
+
+    __slots__ = ('material_key', 'qty', 'area', 'fields')
+
+    def __init__(self, material_key, qty, area, fields):
+        self.material_key = material_key
+        self.qty = qty
+        self.area = area
+        self.fields = fields
+
+    def record(self, load_no, nest_id, cdate):
+        # Same fields, order and string values the nest DataFrame had
+        record = collections.OrderedDict([('LoadNo', load_no), ('NestId', nest_id), ('Cdate', cdate)])
+        record.update(self.fields)
+        record['Area'] = str(self.area)
+        record['Qty'] = str(self.qty)
+        return record
+
+
+class Nest(object):
+    """Line items of one load, with the totals and the S4 payload computed from them."""
+
+    def __init__(self, load_no, nest_id, cdate, items):
+        self.load_no = load_no
+        self.nest_id = nest_id
+        self.cdate = cdate
+        self.items = items
+
+    @property
+    def empty(self):
+        return not self.items
+
+    @property
+    def total_area(self):
+        return np.round(np.float64(sum(item.area for item in self.items)), 2)
+
+    def loading_level(self, capacity):
+        # Share of the nest capacity in use, in percent
+        return np.round(self.total_area / capacity * 100, 2)
+
+    def partition(self, correct_keys):
+        """Splits into (correct, wrong) nests by material key."""
+        correct = [item for item in self.items if item.material_key in correct_keys]
+        wrong = [item for item in self.items if item.material_key not in correct_keys]
+        return (Nest(self.load_no, self.nest_id, self.cdate, correct),
+                Nest(self.load_no, self.nest_id, self.cdate, wrong))
+
+    def records(self):
+        return [item.record(self.load_no, self.nest_id, self.cdate) for item in self.items]
+
+    def frame(self):
+        """The nest DataFrame the work order check takes, built only for that call."""
+        import pandas as pd
+        return pd.DataFrame(self.records())
+
+    def correct_keys(self, check):
+        """Material keys of the rows `check(frame)` returns as correct, e.g. odata.check_data."""
+        if self.empty:
+            return frozenset()
+        correct, wrong = check(self.frame())
+        return frozenset(correct["MaterialNo"].str.lstrip("0").astype(int).tolist())
+
+    def payload(self):
+        """The nest JSON posted to S4, byte for byte what the DataFrame path produced."""
+        # DataFrame.to_json writes compact JSON and escapes forward slashes
+        records = json.dumps(self.records(), separators=(',', ':')).replace('/', '\\/')
+        return '{"MaterialNo": "000000","Area": "","Color": "","ZDetailToItem": ' + records + '}'
+
+    def __str__(self):
+        return '\n'.join(str(dict(record)) for record in self.records())
+
+
+def build_nest(index, quantities, load_no, nest_id, cdate):
+    """Nest of the materials in `quantities` (material key -> qty), from a MaterialIndex."""
+    items = []
+    for fields, key, unit_area in zip(index.records, index.material_keys.tolist(), index.unit_areas.tolist()):
+        qty = quantities.get(key)
+        if qty is None:
+            continue
+        items.append(LineItem(key, qty, float(np.round(unit_area * qty, 3)), fields))
+    return Nest(load_no, nest_id, cdate, items)
@@ -0,0 +1,169 @@
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Outbox(object):
+    """Durable queue of S4 calls, drained by a background sender.
+
+    Every call (kind + JSON arguments) is a row in a local SQLite file, so
+    /predict can return as soon as its load is recorded. The sender claims the
+    ready rows of any number of loads at once, sends them concurrently through
+    `handlers[kind](*args)`, deletes the ones that went through and reschedules
+    failures with exponential backoff. A claim is a lease on the row: if the
+    process dies mid-send the row becomes ready again once the lease runs out,
+    and several processes can share one file without sending a row twice. The
+    lease is renewed while a call is still in flight, so a slow S4 call is not
+    claimed and sent again by another process. A row that failed
+    `max_attempts` times is dead: it stays in the file with its last error but
+    is no longer sent, and `stats()` counts it.
+    """
+
+    def __init__(self, path, handlers, max_workers=8, batch_size=32, poll_interval=1.0,
+                 backoff=2.0, max_backoff=300.0, lease=120.0, max_attempts=30):
+        self.path = path
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._sender = None
+        self._sent = 0
+        self._failed = 0
+
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                load_no TEXT,
+                kind TEXT NOT NULL,
+                args TEXT NOT NULL,
+                created REAL NOT NULL,
+                next_attempt REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS outbox_next_attempt ON outbox (next_attempt)")
+
+    def enqueue(self, load_no, calls):
+        """Records the (kind, args) calls of one load in a single transaction."""
+        now = time.time()
+        rows = [(str(load_no), kind, json.dumps(args), now, now) for kind, args in calls]
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "INSERT INTO outbox (load_no, kind, args, created, next_attempt) VALUES (?, ?, ?, ?, ?)", rows)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        self._wakeup.set()
+
+    def start(self):
+        with self._lock:
+            if self._sender is None:
+                self._sender = threading.Thread(target=self._run, name='outbox-sender')
+                self._sender.daemon = True
+                self._sender.start()
+
+    def stats(self):
+        """Queue depth, how many rows are ready, backing off or dead, and the age of the oldest live row."""
+        now = time.time()
+        with self._lock:
+            depth, ready, oldest = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(next_attempt <= ?), 0), MIN(created) FROM outbox WHERE attempts < ?",
+                (now, self.max_attempts)).fetchone()
+            retrying, dead = self._db.execute(
+                "SELECT COALESCE(SUM(attempts < ?), 0), COALESCE(SUM(attempts >= ?), 0) FROM outbox WHERE attempts > 0",
+                (self.max_attempts, self.max_attempts)).fetchone()
+        return {
+            'depth': depth,
+            'ready': ready,
+            'retrying': retrying,
+            'dead': dead,
+            'lag_seconds': round(now - oldest, 3) if oldest is not None else 0.0,
+            'sent': self._sent,
+            'failed_attempts': self._failed,
+        }
+
+    def drain(self):
+        """Sends one batch of ready calls, returns how many were claimed."""
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        in_flight = dict((self._executor.submit(self.handlers[kind], *json.loads(args)), (row_id, attempts))
+                         for row_id, kind, args, attempts in rows)
+
+        started = renewed = time.time()
+        while in_flight:
+            done, _ = wait(in_flight, timeout=self.lease / 3, return_when=FIRST_COMPLETED)
+            for future in done:
+                row_id, attempts = in_flight.pop(future)
+                self._finish(row_id, attempts, future.exception())
+            if in_flight and time.time() - renewed >= self.lease / 3:
+                # Calls still running keep their rows, no other sender may claim them
+                renewed = time.time()
+                row_ids = [row_id for row_id, _ in in_flight.values()]
+                self._renew(row_ids, renewed)
+                if renewed - started >= self.lease:
+                    print("Outbox calls {} still in flight after {:.0f} s".format(row_ids, renewed - started))
+        return len(rows)
+
+    def _finish(self, row_id, attempts, error):
+        with self._lock:
+            if error is None:
+                self._db.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+                self._sent += 1
+                return
+            delay = min(self.max_backoff, self.backoff * 2 ** attempts)
+            self._db.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                (attempts + 1, time.time() + delay, repr(error), row_id))
+            self._failed += 1
+        if attempts + 1 >= self.max_attempts:
+            print("Outbox call {} failed {} times, giving up: {!r}".format(row_id, attempts + 1, error))
+        else:
+            print("Outbox call {} failed, retrying in {:.0f} s: {!r}".format(row_id, delay, error))
+
+    def _renew(self, row_ids, now):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE outbox SET next_attempt = ? WHERE id = ?", [(now + self.lease, row_id) for row_id in row_ids])
+
+    def _claim(self):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT id, kind, args, attempts FROM outbox WHERE next_attempt <= ? AND attempts < ? "
+                    "ORDER BY id LIMIT ?", (now, self.max_attempts, self.batch_size)).fetchall()
+                self._db.executemany(
+                    "UPDATE outbox SET next_attempt = ? WHERE id = ?", [(now + self.lease, row[0]) for row in rows])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                claimed = self.drain()
+            except Exception as e:
+                print("Outbox sender error:", repr(e))
+                claimed = 0
+            if claimed < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
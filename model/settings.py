@@ -0,0 +1,70 @@
+import os
+
+# Serving settings, overridable through the environment (e.g. `cf set-env`)
+
+# Micro-batching of concurrent /predict calls in front of the detector
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", 5))
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 8))
+
+# Frames are downscaled to fit INPUT_WIDTH x INPUT_HEIGHT before inference
+# (JPEGs decoded at reduced resolution if ANNOTATE_IN_BACKGROUND is on);
+# annotation still uses the full resolution image. 0 feeds the detector
+# full-resolution frames.
+INPUT_WIDTH = int(os.environ.get("INPUT_WIDTH", 640))
+INPUT_HEIGHT = int(os.environ.get("INPUT_HEIGHT", 480))
+
+# Directory of the frozen detection graph
+MODEL_DIR = os.environ.get("MODEL_DIR", "./model/inference_graph")
+
+# Inference engine for the detector: "tf" runs the frozen graph in a TF session,
+# "onnx" runs frozen_inference_graph.onnx on ONNX Runtime's CPU provider (needs
+# onnxruntime installed)
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "tf")
+
+# Inferences on synthetic frames of the input size after the model is loaded,
+# before /ready reports the instance ready
+WARMUP_RUNS = int(os.environ.get("WARMUP_RUNS", 3))
+
+# Intra-op and inter-op thread pool sizes of the inference session, 0 lets the
+# engine decide. gunicorn.conf.py sets them to each worker's share of the cores.
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", 0))
+INFERENCE_INTER_OP_THREADS = int(os.environ.get("INFERENCE_INTER_OP_THREADS", 0))
+
+# Run the detector in one inference process that all web workers share,
+# instead of a copy of the model per worker. Frames and detections are passed
+# through FRAME_RING_SLOTS shared memory slots of INPUT_WIDTH x INPUT_HEIGHT.
+INFERENCE_SERVER = os.environ.get("INFERENCE_SERVER", "0") == "1"
+FRAME_RING_SLOTS = int(os.environ.get("FRAME_RING_SLOTS", 16))
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", 60))
+
+# Model file variant written by tools/optimize_graph.py, e.g. "optimized" or
+# "int8"; empty serves frozen_inference_graph.pb/.onnx as exported
+MODEL_VARIANT = os.environ.get("MODEL_VARIANT", "")
+
+# Render the annotated image and post to S4 on a background worker, so the
+# count/verdict response returns as soon as inference is done
+ANNOTATE_IN_BACKGROUND = os.environ.get("ANNOTATE_IN_BACKGROUND", "0") == "1"
+# Loads waiting for the background worker, each holding its upload; a request
+# past this many waits for one to finish instead of growing the backlog
+BACKGROUND_QUEUE_SIZE = int(os.environ.get("BACKGROUND_QUEUE_SIZE", 16))
+
+# Recognise the colour of every detected part and show it in the labels
+COLOR_RECOGNITION = os.environ.get("COLOR_RECOGNITION", "0") == "1"
+
+# S4 calls in flight at once per process, the four posts of a load go out together
+S4_CONCURRENCY = int(os.environ.get("S4_CONCURRENCY", 8))
+
+# Record S4 postings in a local durable outbox and send them from a background
+# sender, so /predict does not wait on the ERP
+OUTBOX = os.environ.get("OUTBOX", "1") == "1"
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", "./model/outbox.db")
+# Failed sends of one call before it is kept as dead instead of retried
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 30))
+
+# In-process cache of material numbers and material master rows
+MASTER_DATA_TTL = float(os.environ.get("MASTER_DATA_TTL", 3600))
+MASTER_DATA_CACHE_SIZE = int(os.environ.get("MASTER_DATA_CACHE_SIZE", 256))
+
+# Load numbers fetched ahead of time; 0 fetches each one concurrently with
+# decode and inference instead. Only raise it if get_load_no reserves numbers.
+LOAD_NO_PREFETCH = int(os.environ.get("LOAD_NO_PREFETCH", 0))
@@ -1,19 +1,31 @@
-import glob, os
-import tensorflow as tf
+import os
+import threading
+import time
+import numpy as np
+from model import settings
 from model.utils import label_map_util
+from model.utils.batch_scheduler import BatchScheduler
+
+# Process-wide registry of loaded models, keyed by model directory
+_models = {}
+_schedulers = {}
+_models_lock = threading.Lock()
+
+def model_file(model, extension, variant=None):
+  # frozen_inference_graph.pb as exported, or an optimized variant of it such as
+  # frozen_inference_graph.int8.pb written by tools/optimize_graph.py
+  if variant is None:
+    variant = settings.MODEL_VARIANT
+  return model + '/frozen_inference_graph' + ('.' + variant if variant else '') + extension
 
-def set_model(model):
-  # Set model
-  model_name = model
 
+def load_model(model, variant=None):
   # Path to frozen detection graph. This is the actual model that is used for the object detection.
-  path_to_ckpt = model_name + '/frozen_inference_graph.pb'
+  path_to_ckpt = model_file(model, '.pb', variant)
   print(path_to_ckpt)
 
-  # List of the strings that is used to add correct label for each box.
-  path_to_labels = os.path.join('model/data', 'labelmap.pbtxt')
-
-  num_classes = 8
+  # Imported here, so processes that never run the TF backend do not load it
+  import tensorflow as tf
 
   # Load a (frozen) Tensorflow model into memory.
   detection_graph = tf.Graph()
@@ -24,9 +36,215 @@ def set_model(model):
       od_graph_def.ParseFromString(serialized_graph)
       tf.import_graph_def(od_graph_def, name='')
 
+  return detection_graph, load_category_index()
+
+
+def load_category_index():
+  # List of the strings that is used to add correct label for each box.
+  path_to_labels = os.path.join('model/data', 'labelmap.pbtxt')
+
+  num_classes = 8
+
   # Loading label map
   label_map = label_map_util.load_labelmap(path_to_labels)
   categories = label_map_util.convert_label_map_to_categories(label_map, max_num_classes=num_classes, use_display_name=True)
-  category_index = label_map_util.create_category_index(categories)
+  return label_map_util.create_category_index(categories)
+
+
+def set_model(model):
+  # Kept for scripts that want their own private copy of the graph;
+  # the request path should use get_model instead.
+  return load_model(model)
+
+
+def synthetic_frames(count, height, width):
+  # Noise rather than black, so post-processing sees candidate boxes as well
+  return np.random.RandomState(0).randint(0, 256, size=(count, height, width, 3), dtype=np.uint8)
+
+
+class DetectionBackend(object):
+  """Interface of an inference engine for the exported detector.
+
+  A backend loads the model once, is warmed up before it takes traffic and
+  runs batches of [N, height, width, 3] uint8 images, returning
+  (boxes, scores, classes, num) the way the TF Object Detection API graph does:
+  normalized boxes, classes as 1-based int32 ids.
+  """
+
+  def __init__(self, model, variant=None):
+    self.model = model
+    self.variant = settings.MODEL_VARIANT if variant is None else variant
+    self.category_index = load_category_index()
+    self.load()
+
+  def load(self):
+    raise NotImplementedError
+
+  def detect_batch(self, images):
+    raise NotImplementedError
+
+  def close(self):
+    pass
+
+  def warm_up(self, height=480, width=640, runs=2):
+    """Runs a few synthetic frames so the first request does not pay for lazy init.
+
+    Returns:
+      the time spent, in seconds.
+    """
+    start = time.time()
+    frame = synthetic_frames(1, height, width)
+    for _ in range(runs):
+      self.detect_batch(frame)
+    return time.time() - start
+
+  def detect(self, image):
+    """Runs the detector on a single [height, width, 3] image.
+
+    Returns:
+      (boxes, scores, classes, num) for that image, with the batch
+      dimension removed and classes cast to int32.
+    """
+    # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
+    image_np_expanded = np.expand_dims(image, axis=0)
+
+    (boxes, scores, classes, num) = self.detect_batch(image_np_expanded)
+
+    return boxes[0], scores[0], classes[0], int(num[0])
+
+
+class DetectionModel(DetectionBackend):
+  """The frozen TF graph with its tensor handles and a long-lived session.
+
+  The graph and label map are parsed once and the session stays open for the
+  lifetime of the process, so callers only pay for `sess.run`.
+  """
+
+  def load(self):
+    import tensorflow as tf
+
+    self.detection_graph, _ = load_model(self.model, self.variant)
+
+    # Definite input and output Tensors for detection_graph
+    self.image_tensor = self.detection_graph.get_tensor_by_name('image_tensor:0')
+
+    # Each box represents a part of the image where a particular object was detected.
+    self.detection_boxes = self.detection_graph.get_tensor_by_name('detection_boxes:0')
+
+    # Each score represent how level of confidence for each of the objects.
+    # Score is shown on the result image, together with the class label.
+    self.detection_scores = self.detection_graph.get_tensor_by_name('detection_scores:0')
+    self.detection_classes = self.detection_graph.get_tensor_by_name('detection_classes:0')
+    self.num_detections = self.detection_graph.get_tensor_by_name('num_detections:0')
+
+    # 0 leaves the thread pool sizes to TF
+    config = tf.ConfigProto(intra_op_parallelism_threads=settings.INFERENCE_THREADS,
+                            inter_op_parallelism_threads=settings.INFERENCE_INTER_OP_THREADS)
+    self.sess = tf.Session(graph=self.detection_graph, config=config)
+
+  def detect_batch(self, images):
+    """Runs the detector on a [N, height, width, 3] batch in one `sess.run`.
+
+    Returns:
+      (boxes, scores, classes, num) with a leading batch dimension of N,
+      classes cast to int32.
+    """
+    # Actual detection.
+    (boxes, scores, classes, num) = self.sess.run(
+        [self.detection_boxes, self.detection_scores, self.detection_classes, self.num_detections],
+        feed_dict={self.image_tensor: images})
+
+    return boxes, scores, classes.astype(np.int32), num
+
+  def close(self):
+    self.sess.close()
+
+
+class OnnxDetectionModel(DetectionBackend):
+  """The same detector exported to ONNX, run by ONNX Runtime on the CPU.
+
+  Expects `frozen_inference_graph.onnx` (or a variant of it, see model_file)
+  next to the frozen graph, converted with its tensor names kept, e.g.
+
+    python -m tf2onnx.convert --opset 11 \\
+      --graphdef model/inference_graph/frozen_inference_graph.pb \\
+      --output model/inference_graph/frozen_inference_graph.onnx \\
+      --inputs image_tensor:0 \\
+      --outputs detection_boxes:0,detection_scores:0,detection_classes:0,num_detections:0
+  """
+
+  OUTPUTS = ('detection_boxes', 'detection_scores', 'detection_classes', 'num_detections')
+
+  def load(self):
+    # Only needed when this backend is selected
+    import onnxruntime as ort
+
+    path_to_onnx = model_file(self.model, '.onnx', self.variant)
+    print(path_to_onnx)
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if settings.INFERENCE_THREADS:
+      options.intra_op_num_threads = settings.INFERENCE_THREADS
+    if settings.INFERENCE_INTER_OP_THREADS:
+      options.inter_op_num_threads = settings.INFERENCE_INTER_OP_THREADS
+    self.session = ort.InferenceSession(path_to_onnx, options, providers=['CPUExecutionProvider'])
+
+    self.input_name = self.session.get_inputs()[0].name
+    # tf2onnx keeps the ':0' suffix of the TF tensor names
+    names = dict((output.name.split(':')[0], output.name) for output in self.session.get_outputs())
+    self.output_names = [names[name] for name in self.OUTPUTS]
+
+  def detect_batch(self, images):
+    """Runs the detector on a [N, height, width, 3] batch in one `session.run`."""
+    (boxes, scores, classes, num) = self.session.run(self.output_names, {self.input_name: images})
+
+    return boxes, scores, classes.astype(np.int32), num
+
+
+# Inference engines selectable through settings.INFERENCE_BACKEND
+BACKENDS = {
+  'tf': DetectionModel,
+  'onnx': OnnxDetectionModel,
+}
+
+
+def get_model(model, backend=None):
+  """Returns the process-wide backend for `model`, loading it on first use.
+
+  `backend` is a key of BACKENDS and defaults to settings.INFERENCE_BACKEND.
+  """
+  key = (model, backend or settings.INFERENCE_BACKEND)
+  detection_model = _models.get(key)
+  if detection_model is None:
+    with _models_lock:
+      detection_model = _models.get(key)
+      if detection_model is None:
+        detection_model = BACKENDS[key[1]](model)
+        warm_up_time = detection_model.warm_up(settings.INPUT_HEIGHT or 480, settings.INPUT_WIDTH or 640, settings.WARMUP_RUNS)
+        print("Warmed up {} backend with {} runs in {:.2f} s".format(key[1], settings.WARMUP_RUNS, warm_up_time))
+        _models[key] = detection_model
+  return detection_model
+
+
+def get_batched_model(model, batch_window_ms, max_batch_size):
+  """Returns the process-wide BatchScheduler in front of get_model(model).
+
+  Concurrent callers of its `detect` are collected for up to
+  `batch_window_ms` milliseconds or `max_batch_size` images and share one
+  `sess.run`.
+  """
+  scheduler = _schedulers.get(model)
+  if scheduler is None:
+    detection_model = get_model(model)
+    with _models_lock:
+      scheduler = _schedulers.get(model)
+      if scheduler is None:
+        scheduler = BatchScheduler(detection_model, batch_window_ms, max_batch_size)
+        _schedulers[model] = scheduler
+  return scheduler
+
 
-  return detection_graph, category_index
+def batch_stats():
+  """Batch-size stats of every scheduler created so far, keyed by model."""
+  return dict((model, scheduler.stats()) for model, scheduler in _schedulers.items())
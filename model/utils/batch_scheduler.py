@@ -0,0 +1,90 @@
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class BatchScheduler(object):
+  """Collects concurrent `detect` calls into batches for one `sess.run`.
+
+  Requests are queued and a single worker thread gathers them for up to
+  `batch_window_ms` milliseconds or until `max_batch_size` images are waiting,
+  runs them through `detection_model.detect_batch` and hands each caller its
+  own slice of the results. Images can only share a batch when they have the
+  same shape, so a mixed batch is split into one run per shape.
+  """
+
+  def __init__(self, detection_model, batch_window_ms=5, max_batch_size=8):
+    self.detection_model = detection_model
+    self.category_index = detection_model.category_index
+    self.batch_window_ms = batch_window_ms
+    self.max_batch_size = max(1, max_batch_size)
+
+    self._queue = queue.Queue()
+    self._stats_lock = threading.Lock()
+    self._batches = 0
+    self._images = 0
+    self._batch_sizes = collections.Counter()
+
+    self._worker = threading.Thread(target=self._run, name='batch-scheduler')
+    self._worker.daemon = True
+    self._worker.start()
+
+  def detect(self, image):
+    """Same contract as DetectionModel.detect, but shares `sess.run` with concurrent callers."""
+    future = Future()
+    self._queue.put((image, future))
+    return future.result()
+
+  def stats(self):
+    """Settings and achieved batch sizes since start-up."""
+    with self._stats_lock:
+      return {
+          'batch_window_ms': self.batch_window_ms,
+          'max_batch_size': self.max_batch_size,
+          'batches': self._batches,
+          'images': self._images,
+          'mean_batch_size': round(float(self._images) / self._batches, 3) if self._batches else 0.0,
+          'batch_size_histogram': dict(self._batch_sizes),
+      }
+
+  def _run(self):
+    while True:
+      batch = [self._queue.get()]
+      deadline = time.time() + self.batch_window_ms / 1000.0
+      while len(batch) < self.max_batch_size:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          break
+        try:
+          batch.append(self._queue.get(timeout=remaining))
+        except queue.Empty:
+          break
+      self._dispatch(batch)
+
+  def _dispatch(self, batch):
+    # Group by image shape, only same-sized frames can be stacked into one tensor
+    groups = collections.OrderedDict()
+    for image, future in batch:
+      groups.setdefault(image.shape, []).append((image, future))
+
+    for requests in groups.values():
+      futures = [future for _, future in requests]
+      try:
+        images = np.stack([image for image, _ in requests])
+        (boxes, scores, classes, num) = self.detection_model.detect_batch(images)
+      except Exception as e:
+        for future in futures:
+          future.set_exception(e)
+        continue
+
+      with self._stats_lock:
+        self._batches += 1
+        self._images += len(requests)
+        self._batch_sizes[len(requests)] += 1
+
+      for i, future in enumerate(futures):
+        future.set_result((boxes[i], scores[i], classes[i], int(num[i])))
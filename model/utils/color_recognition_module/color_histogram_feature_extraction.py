@@ -4,15 +4,20 @@
 #--- Date           : 31st December 2017 - new year eve :)
 #----------------------------------------------
 
-from PIL import Image
 import os
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.stats import itemfreq
-from utils.color_recognition_module import knn_classifier as knn_classifier
 current_path = os.getcwd()
 
+def color_histogram_features(image):
+	# peak pixel values of the R, G and B histograms, kept in memory
+	features = []
+	for chan in cv2.split(image):
+		hist = cv2.calcHist([chan], [0], None, [256], [0, 256])
+		features.append(int(np.argmax(hist)))
+	blue, green, red = features
+	return [red, green, blue]
+
 def color_histogram_of_test_image(test_src_image):
 	#load the image
 	image = test_src_image
@@ -90,30 +95,9 @@ def color_histogram_of_training_image(img_name):
 		myfile.write(feature_data + "," + data_source + "\n")
 	
 def training():
-	#red color training images
-	for f in os.listdir("./training_dataset/red"):
-		color_histogram_of_training_image("./training_dataset/red/"+f)
-
-	#yellow color training images
-	for f in os.listdir("./training_dataset/yellow"):
-		color_histogram_of_training_image("./training_dataset/yellow/"+f)
-
-	#green color training images
-	for f in os.listdir("./training_dataset/green"):
-		color_histogram_of_training_image("./training_dataset/green/"+f)
-
-	#orange color training images
-	for f in os.listdir("./training_dataset/orange"):
-		color_histogram_of_training_image("./training_dataset/orange/"+f)
-
-	#white color training images
-	for f in os.listdir("./training_dataset/white"):
-		color_histogram_of_training_image("./training_dataset/white/"+f)
-
-	#black color training images
-	for f in os.listdir("./training_dataset/black"):
-		color_histogram_of_training_image("./training_dataset/black/"+f)
-
-	#blue color training images
-	for f in os.listdir("./training_dataset/blue"):
-		color_histogram_of_training_image("./training_dataset/blue/"+f)
+	# Features of every colour folder (violet included), extracted in parallel into
+	# the binary feature store; only new or changed images are processed. The
+	# training.data CSV is rewritten from the store rather than appended to.
+	from model.utils.color_recognition_module import color_training
+	store = color_training.train()
+	color_training.export_training_data(store, "training.data")
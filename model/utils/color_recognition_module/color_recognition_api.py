@@ -1,9 +1,17 @@
-from utils.color_recognition_module import color_histogram_feature_extraction
-from utils.color_recognition_module import knn_classifier
+from model.utils.color_recognition_module import color_histogram_feature_extraction
+from model.utils.color_recognition_module import knn_classifier
 import os
-from utils.image_utils import crop_image
+from model.utils.image_utils import crop_image
 
 current_path = os.getcwd()
+module_path = os.path.dirname(os.path.abspath(__file__))
+
+def training_data():
+  # Prefer the binary feature store of color_training, fall back to the CSV
+  store = os.path.join(module_path, "training_features.npy")
+  if os.path.exists(store):
+    return store
+  return os.path.join(module_path, "training.data")
 
 def color_recognition(crop_img):
  
@@ -16,3 +24,10 @@ def color_recognition(crop_img):
   prediction = knn_classifier.main(current_path + "/utils/color_recognition_module/" + "training.data", current_path + "/utils/color_recognition_module/" + "test.data")
 
   return prediction
+
+def color_recognition_batch(crop_imgs):
+  # Colour of every detected object of a frame in one classifier call, no test.data round-trip
+  if not crop_imgs:
+    return []
+  features = [color_histogram_feature_extraction.color_histogram_features(crop_image.crop_center(crop_img, 50, 50)) for crop_img in crop_imgs]
+  return knn_classifier.get_classifier(training_data()).predict(features)
@@ -0,0 +1,116 @@
+"""Incremental colour training over training_dataset/<colour>/ folders.
+
+Features are extracted in a process pool and kept in a binary feature store
+(a NumPy structured array saved with np.save), one row per image keyed by the
+SHA-1 of its content. A re-run only extracts features for images whose content
+is not in the store yet and drops rows of images that are gone.
+
+  python -m model.utils.color_recognition_module.color_training
+"""
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from model.utils.color_recognition_module import color_histogram_feature_extraction
+
+module_path = os.path.dirname(os.path.abspath(__file__))
+dataset_path = os.path.join(module_path, "training_dataset")
+store_path = os.path.join(module_path, "training_features.npy")
+
+FEATURE_DTYPE = np.dtype([('hash', 'S40'), ('red', 'u1'), ('green', 'u1'), ('blue', 'u1'), ('label', 'S16')])
+
+
+def load_store(path=store_path):
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=FEATURE_DTYPE)
+    return np.load(path)
+
+
+def save_store(features, path=store_path):
+    # Write next to the store and swap, so readers never see a half written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, features)
+    os.replace(tmp_path, path)
+
+
+def _content_hash(img_path):
+    with open(img_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest().encode("ascii")
+
+
+def _extract(img_path):
+    image = cv2.imread(img_path)
+    if image is None:
+        return None
+    return color_histogram_feature_extraction.color_histogram_features(image)
+
+
+def dataset_images(dataset=dataset_path):
+    # (path, colour) for every file, the folder name is the colour label
+    for label in sorted(os.listdir(dataset)):
+        folder = os.path.join(dataset, label)
+        if not os.path.isdir(folder):
+            continue
+        for f in sorted(os.listdir(folder)):
+            yield os.path.join(folder, f), label
+
+
+def train(dataset=dataset_path, path=store_path, workers=None):
+    """Brings the feature store in line with the dataset and returns it."""
+    start = time.time()
+    known = dict(((row['hash'], row['label'].decode()), row) for row in load_store(path))
+
+    rows, pending, kept = [], [], set()
+    for img_path, label in dataset_images(dataset):
+        key = (_content_hash(img_path), label)
+        if key in known:
+            rows.append(known[key])
+            kept.add(key)
+        else:
+            pending.append((img_path, key))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            features = executor.map(_extract, [img_path for img_path, _ in pending], chunksize=16)
+            for (img_path, (content_hash, label)), feature in zip(pending, features):
+                if feature is None:
+                    print("Skipping unreadable image", img_path)
+                    continue
+                red, green, blue = feature
+                rows.append((content_hash, red, green, blue, label.encode()))
+
+    store = np.array([tuple(row) for row in rows], dtype=FEATURE_DTYPE)
+    save_store(store, path)
+    print("Feature store: {} images, {} extracted, {} dropped, {:.2f} s".format(
+        len(store), len(pending), len(known) - len(kept), time.time() - start))
+    return store
+
+
+def export_training_data(store, filename):
+    # Same "r,g,b,colour" lines the CSV loader and knn_classifier.main read
+    with open(filename, "w") as myfile:
+        for row in store:
+            myfile.write("{},{},{},{}\n".format(row['red'], row['green'], row['blue'], row['label'].decode()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract colour features for the KNN classifier.")
+    parser.add_argument("--dataset", default=dataset_path, help="folder with one sub-folder per colour")
+    parser.add_argument("--store", default=store_path, help="binary feature store to update")
+    parser.add_argument("--workers", type=int, default=None, help="extraction processes, defaults to the CPU count")
+    parser.add_argument("--export-csv", default=None, help="also write the features as a training.data CSV")
+    args = parser.parse_args()
+
+    store = train(args.dataset, args.store, args.workers)
+    if args.export_csv:
+        export_training_data(store, args.export_csv)
+
+
+if __name__ == "__main__":
+    main()
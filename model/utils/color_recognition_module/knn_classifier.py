@@ -6,10 +6,11 @@
 # -*- coding: utf-8 -*-
 
 import csv
-import random
 import math
 import operator
-import cv2
+import os
+import threading
+import numpy as np
             
 # calculation of euclidead distance    
 def calculateEuclideanDistance(variable1, variable2, length):
@@ -44,7 +45,11 @@ def responseOfNeighbors(neighbors):
     return sortedVotes[0][0]
     
 # Load image feature data to training feature vectors and test feature vector
-def loadDataset(filename, filename2, training_feature_vector=[] , test_feature_vector=[]):
+def loadDataset(filename, filename2, training_feature_vector=None, test_feature_vector=None):
+    if training_feature_vector is None:
+        training_feature_vector = []
+    if test_feature_vector is None:
+        test_feature_vector = []
     with open(filename) as csvfile:
         lines = csv.reader(csvfile)
         dataset = list(lines)
@@ -61,14 +66,77 @@ def loadDataset(filename, filename2, training_feature_vector=[] , test_feature_v
                 dataset[x][y] = float(dataset[x][y])
             test_feature_vector.append(dataset[x])
                 
+    return training_feature_vector, test_feature_vector
+
+class KnnClassifier(object):
+    """K nearest neighbours colour classifier over a preloaded training matrix.
+
+    The training features are parsed once into a NumPy matrix. A whole batch of
+    feature vectors is classified with one vectorized distance computation and
+    an argpartition top-k vote, giving the same answers as kNearestNeighbors
+    and responseOfNeighbors: neighbours are ordered by distance with ties kept
+    in training file order, and a tied vote goes to the nearest label.
+    """
+
+    def __init__(self, training_data, k=3, compared_features=2):
+        # kNearestNeighbors compares len(test)-1 features, which for the
+        # unlabelled R,G,B test vectors means R and G only. Keep that by
+        # default so predictions do not change.
+        self.k = k
+        self.compared_features = compared_features
+        if training_data.endswith('.npy'):
+            # Binary feature store written by color_training
+            store = np.load(training_data)
+            self.features = np.stack([store['red'], store['green'], store['blue']], axis=1).astype(np.float64)
+            labels = store['label'].astype(str)
+        else:
+            with open(training_data) as csvfile:
+                rows = [row for row in csv.reader(csvfile) if row]
+            self.features = np.array([[float(v) for v in row[:3]] for row in rows])
+            labels = [row[3] for row in rows]
+        self.labels, self.label_ids = np.unique(labels, return_inverse=True)
+
+    def predict(self, feature_vectors):
+        """Returns the predicted colour name for each row of an [M, 3] array."""
+        queries = np.asarray(feature_vectors, dtype=np.float64).reshape(-1, self.features.shape[1])
+        n = self.compared_features
+        diff = queries[:, np.newaxis, :n] - self.features[np.newaxis, :, :n]
+        distances = np.sqrt(np.einsum('mnf,mnf->mn', diff, diff))
+
+        k = min(self.k, distances.shape[1])
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        rows = np.arange(distances.shape[0])[:, np.newaxis]
+        kth_distance = distances[rows, nearest].max(axis=1)
+        for m in np.nonzero((distances <= kth_distance[:, np.newaxis]).sum(axis=1) > k)[0]:
+            # Ties at the k-th distance, pick them in training file order
+            nearest[m] = np.argsort(distances[m], kind='mergesort')[:k]
+        order = np.lexsort((nearest, distances[rows, nearest]))
+        nearest = nearest[rows, order]
+
+        # Majority vote, argmax picks the nearest of the tied labels
+        votes = self.label_ids[nearest]
+        counts = (votes[:, :, np.newaxis] == votes[:, np.newaxis, :]).sum(axis=2)
+        winners = votes[rows[:, 0], counts.argmax(axis=1)]
+        return [str(label) for label in self.labels[winners]]
+
+# Classifiers already loaded in this process, keyed by training file and its mtime
+_classifiers = {}
+_classifiers_lock = threading.Lock()
+
+def get_classifier(training_data):
+    key = (training_data, os.path.getmtime(training_data))
+    classifier = _classifiers.get(key)
+    if classifier is None:
+        with _classifiers_lock:
+            classifier = _classifiers.get(key)
+            if classifier is None:
+                classifier = KnnClassifier(training_data)
+                _classifiers.clear()
+                _classifiers[key] = classifier
+    return classifier
+
 def main(training_data, test_data):
-    training_feature_vector=[] #training feature vector
-    test_feature_vector=[] #test feature vector
-    loadDataset(training_data, test_data, training_feature_vector, test_feature_vector)
-    classifier_prediction=[] #predictions   
-    k = 3  # K value of k nearest neighbor
-    for x in range(len(test_feature_vector)):
-        neighbors = kNearestNeighbors(training_feature_vector, test_feature_vector[x], k)
-        result = responseOfNeighbors(neighbors)
-        classifier_prediction.append(result)
+    with open(test_data) as csvfile:
+        test_feature_vector = [row[:3] for row in csv.reader(csvfile) if row]
+    classifier_prediction = get_classifier(training_data).predict(test_feature_vector)
     return classifier_prediction[0]
@@ -0,0 +1,365 @@
+import mmap
+import multiprocessing
+import os
+import pickle
+import signal
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from model import settings
+from model.utils.image_utils import image_codec
+
+# Set in the process that starts the inference process, inherited by forked web workers
+_ring = None
+_client = None
+_ring_lock = threading.Lock()
+
+_HEADER_BYTES = 64 * 1024
+_ALIGN = 64
+
+STATUS_OK = 0
+STATUS_FAILED = 1
+
+# Columns of the slot table: whether the slot is taken, the pid of the
+# inference process working on it (0 while queued) and whether its client gave
+# up waiting
+_IN_USE = 0
+_OWNER = 1
+_ABANDONED = 2
+
+# Pause before the supervisor starts a new inference process after one exited
+_RESTART_DELAY = 5.0
+
+# Signals gunicorn handles in the master and the workers, reset in the processes forked from them
+_SIGNALS = ('SIGHUP', 'SIGQUIT', 'SIGINT', 'SIGTERM', 'SIGTTIN', 'SIGTTOU', 'SIGUSR1', 'SIGUSR2', 'SIGWINCH', 'SIGCHLD')
+
+
+class FrameRing(object):
+  """Fixed slots in an anonymous shared mapping, created before the fork.
+
+  Each slot holds one frame and the detections for it. A web worker takes a
+  free slot, writes its frame into it and queues (slot, shape); the inference
+  process runs the detector on a view of the slot, writes the results back
+  into it and releases the slot's semaphore. Only slot numbers and shapes go
+  through the pipe, the pixels and the detections stay in shared memory.
+  The header holds the pickled category index, written once the model is
+  loaded; `ready` is set while an inference process is serving.
+
+  Free slots are counted by a semaphore, so taking one can time out. A shared
+  slot table records which inference process works on a slot and whether its
+  client stopped waiting for it. A slot is handed out again once it is safe:
+  by the inference process when a late result for an abandoned slot is done,
+  or by whoever finds the process working on it dead.
+  """
+
+  def __init__(self, slots, max_height, max_width, max_detections=100):
+    self.slots = slots
+    self.max_height = max_height
+    self.max_width = max_width
+    self.max_detections = max_detections
+    self.frame_bytes = max_height * max_width * 3
+    # boxes, scores, classes, then num detections and a status word
+    self.result_bytes = max_detections * (4 * 4 + 4 + 4) + 8
+    self.slot_bytes = _aligned(self.frame_bytes) + _aligned(self.result_bytes)
+
+    self.buffer = mmap.mmap(-1, _HEADER_BYTES + slots * self.slot_bytes)
+    self.table = np.ndarray((slots, 3), dtype=np.int32, buffer=mmap.mmap(-1, slots * 3 * 4))
+    # A plain pipe has no feeder thread, so it also works across gunicorn's plain
+    # os.fork. Only the writers take a lock: the one reader holding one when it is
+    # killed would leave its replacement unable to read.
+    self._requests_reader, self._requests_writer = multiprocessing.Pipe(duplex=False)
+    self._requests_lock = multiprocessing.Lock()
+    self.free = multiprocessing.Semaphore(slots)
+    self.lock = multiprocessing.Lock()
+    self.done = [multiprocessing.Semaphore(0) for _ in range(slots)]
+    self.ready = multiprocessing.Event()
+
+  def submit(self, slot, shape):
+    """Queues the frame in `slot` for the inference process."""
+    with self._requests_lock:
+      self._requests_writer.send((slot, shape))
+
+  def next_request(self):
+    """(slot, shape) of the next queued frame, claimed for this (inference) process.
+
+    Reading and claiming happen under the ring lock, so no slot is left read but
+    without an owner when the process dies: its replacement either reads the
+    request from the pipe again or finds the slot owned by a dead process.
+    """
+    # Only this process reads, so a request that is ready stays ready until it is read
+    self._requests_reader.poll(None)
+    with self.lock:
+      slot, shape = self._requests_reader.recv()
+      self.table[slot, _OWNER] = os.getpid()
+    return slot, shape
+
+  def take(self, timeout=None):
+    """Number of a free slot, None if none came free within `timeout` seconds."""
+    if not self.free.acquire(timeout=timeout):
+      return None
+    with self.lock:
+      slot = int(np.argmin(self.table[:, _IN_USE]))
+      self.table[slot] = (1, 0, 0)
+    return slot
+
+  def give_back(self, slot):
+    with self.lock:
+      self._release(slot)
+
+  def _release(self, slot):
+    # Caller holds self.lock
+    self.table[slot] = 0
+    self.free.release()
+
+  def finish(self, slot):
+    """Hands the result in `slot` to its client, or frees the slot if the client gave up."""
+    with self.lock:
+      if self.table[slot, _ABANDONED]:
+        self._release(slot)
+      else:
+        self.table[slot, _OWNER] = 0
+        self.done[slot].release()
+
+  def abandon(self, slot):
+    """Called by a client that stops waiting. True if the result arrived after all."""
+    with self.lock:
+      if self.done[slot].acquire(False):
+        return True
+      owner = int(self.table[slot, _OWNER])
+      if owner and not _alive(owner):
+        # Nobody will ever finish it
+        self._release(slot)
+      else:
+        # Freed by the inference process once its late result is written
+        self.table[slot, _ABANDONED] = 1
+      return False
+
+  def recover(self):
+    """Run by a new inference process: settles the slots a dead one was working on."""
+    recovered = 0
+    with self.lock:
+      for slot in range(self.slots):
+        owner = int(self.table[slot, _OWNER])
+        if not self.table[slot, _IN_USE] or not owner or _alive(owner):
+          continue
+        if self.table[slot, _ABANDONED]:
+          self._release(slot)
+        else:
+          # Its client is still waiting, fail it now instead of at its timeout
+          self.results(slot)[3][:] = (0, STATUS_FAILED)
+          self.table[slot, _OWNER] = 0
+          self.done[slot].release()
+        recovered += 1
+    return recovered
+
+  def fits(self, shape):
+    return int(np.prod(shape)) <= self.frame_bytes
+
+  def frame(self, slot, shape):
+    """uint8 view of the frame in `slot`."""
+    return np.ndarray(shape, dtype=np.uint8, buffer=self.buffer, offset=self._offset(slot))
+
+  def results(self, slot):
+    """Views of (boxes, scores, classes, num, status) in `slot`."""
+    offset = self._offset(slot) + _aligned(self.frame_bytes)
+    n = self.max_detections
+    boxes = np.ndarray((n, 4), dtype=np.float32, buffer=self.buffer, offset=offset)
+    scores = np.ndarray((n,), dtype=np.float32, buffer=self.buffer, offset=offset + n * 16)
+    classes = np.ndarray((n,), dtype=np.int32, buffer=self.buffer, offset=offset + n * 20)
+    tail = np.ndarray((2,), dtype=np.int32, buffer=self.buffer, offset=offset + n * 24)
+    return boxes, scores, classes, tail
+
+  def publish(self, category_index):
+    data = pickle.dumps(category_index)
+    if len(data) + 4 > _HEADER_BYTES:
+      raise ValueError('Category index does not fit the frame ring header.')
+    self.buffer[:4 + len(data)] = struct.pack('<I', len(data)) + data
+    self.ready.set()
+
+  def category_index(self, timeout=None):
+    if not self.ready.wait(timeout):
+      raise RuntimeError('Inference process did not load the model in time.')
+    size = struct.unpack('<I', self.buffer[:4])[0]
+    return pickle.loads(self.buffer[4:4 + size])
+
+  def _offset(self, slot):
+    return _HEADER_BYTES + slot * self.slot_bytes
+
+
+def _aligned(size):
+  return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _alive(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    return True
+  return True
+
+
+class RingClient(object):
+  """Same `detect`/`category_index` contract as DetectionModel, served by the inference process."""
+
+  def __init__(self, ring, timeout):
+    self.ring = ring
+    self.timeout = timeout
+    self._category_index = None
+
+  @property
+  def category_index(self):
+    if self._category_index is None:
+      self._category_index = self.ring.category_index(self.timeout)
+    return self._category_index
+
+  def detect(self, image):
+    if not self.ring.fits(image.shape):
+      # Boxes are normalized, so a smaller copy gives the same detections
+      image = image_codec.fit_image(image, self.ring.max_width, self.ring.max_height)
+
+    slot = self.ring.take(self.timeout)
+    if slot is None:
+      raise RuntimeError('No free frame ring slot within {} s.'.format(self.timeout))
+    try:
+      self.ring.frame(slot, image.shape)[...] = image
+      self.ring.submit(slot, image.shape)
+    except Exception:
+      self.ring.give_back(slot)
+      raise
+
+    if not self.ring.done[slot].acquire(timeout=self.timeout) and not self.ring.abandon(slot):
+      # The slot is handed out again once the late result is written, or its inference process is gone
+      raise RuntimeError('No detections from the inference process within {} s.'.format(self.timeout))
+
+    try:
+      boxes, scores, classes, tail = self.ring.results(slot)
+      num, status = int(tail[0]), int(tail[1])
+      if status != STATUS_OK:
+        raise RuntimeError('Inference process failed on the frame.')
+      return boxes[:num].copy(), scores[:num].copy(), classes[:num].copy(), num
+    finally:
+      self.ring.give_back(slot)
+
+
+def serve(ring, model):
+  """Main loop of the inference process: batched detection over the ring slots."""
+  # Imported here so the web workers never load the inference engine
+  from model.utils import backbone
+
+  detection_model = backbone.get_batched_model(model, settings.BATCH_WINDOW_MS, settings.MAX_BATCH_SIZE)
+  recovered = ring.recover()
+  ring.publish(detection_model.category_index)
+  print("Inference process {} serving {} slots, recovered {}".format(os.getpid(), ring.slots, recovered))
+
+  def handle(slot, shape):
+    boxes, scores, classes, tail = ring.results(slot)
+    try:
+      (frame_boxes, frame_scores, frame_classes, num) = detection_model.detect(ring.frame(slot, shape))
+      num = min(num, ring.max_detections, len(frame_scores))
+      boxes[:num] = frame_boxes[:num]
+      scores[:num] = frame_scores[:num]
+      classes[:num] = frame_classes[:num]
+      tail[:] = (num, STATUS_OK)
+    except Exception as e:
+      print("Inference failed:", repr(e))
+      tail[:] = (0, STATUS_FAILED)
+    ring.finish(slot)
+
+  # One thread per slot, so the batch scheduler sees all waiting frames at once
+  with ThreadPoolExecutor(max_workers=ring.slots) as executor:
+    while True:
+      slot, shape = ring.next_request()
+      executor.submit(handle, slot, shape)
+
+
+def _fork(target, *args):
+  """Plain os.fork, so the child is not in multiprocessing's children of the
+  processes forked later (the web workers' atexit would terminate it)."""
+  pid = os.fork()
+  if pid:
+    return pid
+  code = 1
+  try:
+    for name in _SIGNALS:
+      signal.signal(getattr(signal, name), signal.SIG_DFL)
+    target(*args)
+    code = 0
+  except BaseException as e:
+    print("{} failed: {!r}".format(getattr(target, '__name__', target), e))
+  finally:
+    os._exit(code)
+
+
+def _exit_with(parent):
+  # Exits this process once `parent` has gone
+  def watch():
+    while os.getppid() == parent:
+      time.sleep(1.0)
+    os._exit(0)
+  thread = threading.Thread(target=watch, name='parent-watch')
+  thread.daemon = True
+  thread.start()
+
+
+def _serve_child(ring, model, supervisor):
+  _exit_with(supervisor)
+  serve(ring, model)
+
+
+def supervise(ring, model, parent):
+  """Keeps one inference process running until `parent` exits.
+
+  Clears `ring.ready` while there is none, so /ready reports the outage, and
+  starts a new one _RESTART_DELAY seconds after one exited.
+  """
+  child = None
+  while True:
+    if child is None:
+      child = _fork(_serve_child, ring, model, os.getpid())
+
+    pid, status = os.waitpid(child, os.WNOHANG)
+    if pid:
+      ring.ready.clear()
+      print("Inference process {} exited with status {}, restarting in {:.0f} s".format(pid, status, _RESTART_DELAY))
+      child = None
+      time.sleep(_RESTART_DELAY)
+      continue
+
+    if os.getppid() != parent:
+      os.kill(child, signal.SIGTERM)
+      os.waitpid(child, 0)
+      return
+    time.sleep(0.5)
+
+
+def start_server(model=None):
+  """Creates the ring and forks the supervisor of the inference process, in the process web workers are forked from."""
+  global _ring
+  with _ring_lock:
+    if _ring is None:
+      ring = FrameRing(settings.FRAME_RING_SLOTS, settings.INPUT_HEIGHT or 1080, settings.INPUT_WIDTH or 1920)
+      _fork(supervise, ring, model or settings.MODEL_DIR, os.getpid())
+      _ring = ring
+  return _ring
+
+
+def serving():
+  """Whether an inference process is up and has its model loaded."""
+  return _ring is not None and _ring.ready.is_set()
+
+
+def get_client():
+  """RingClient of this process, starting the inference process if nothing started it before the fork."""
+  global _client
+  if _client is None:
+    ring = start_server()
+    with _ring_lock:
+      if _client is None:
+        _client = RingClient(ring, settings.INFERENCE_TIMEOUT)
+  return _client
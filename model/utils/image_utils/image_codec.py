@@ -0,0 +1,61 @@
+import io
+import cv2
+import numpy as np
+from PIL import Image
+
+# JPEGs can be decoded straight at 1/8, 1/4 or 1/2 of their size
+_REDUCED_DECODE = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+class ImageDecodeError(ValueError):
+    """The bytes are not an image OpenCV can decode."""
+
+
+def image_size(image_bytes): # (width, height) from the image header, without decoding the pixels
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        return image.size
+
+
+def fit_scale(size, width, height): # scale that fits a (width, height) size into width x height, never above 1
+    return min(1.0, float(width) / size[0], float(height) / size[1])
+
+
+def decode_image(image_bytes, width=None, height=None): # decode JPEG/PNG bytes straight into a BGR frame, same layout as cv2.imread
+    if not image_bytes:
+        raise ImageDecodeError('No image data.')
+    flags = cv2.IMREAD_COLOR
+    if width and height and image_bytes[:2] == b'\xff\xd8':
+        # Only as far down as still covers the frame fitted into width x height
+        try:
+            scale = fit_scale(image_size(image_bytes), width, height)
+        except (IOError, OSError, SyntaxError) as e:
+            raise ImageDecodeError('Could not read the image header: {}'.format(e))
+        for factor, reduced in _REDUCED_DECODE:
+            if factor * scale <= 1.0:
+                flags = reduced
+                break
+
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    try:
+        image = cv2.imdecode(buffer, flags)
+    except cv2.error as e:
+        raise ImageDecodeError('Could not decode image data: {}'.format(e))
+    if image is None:
+        raise ImageDecodeError('Could not decode image data.')
+    return image
+
+
+def fit_image(image, width, height): # downscale a frame to fit width x height, keeping its aspect ratio
+    image_height, image_width = image.shape[:2]
+    scale = fit_scale((image_width, image_height), width, height)
+    if scale >= 1.0:
+        return image
+    size = (max(1, int(round(image_width * scale))), max(1, int(round(image_height * scale))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def encode_image(image, ext='.jpg'): # encode a BGR frame into JPEG (or `ext`) bytes without touching the disk
+    ok, buffer = cv2.imencode(ext, image)
+    if not ok:
+        raise ValueError('Could not encode image as {}.'.format(ext))
+    return buffer.tobytes()
@@ -1,5 +1,4 @@
 """Label map utility functions."""
-import tensorflow as tf
 import logging
 from google.protobuf import text_format
 from model.utils.protos import string_int_label_map_pb2
@@ -96,7 +95,7 @@ def load_labelmap(path):
   Returns:
     a StringIntLabelMapProto
   """
-  with tf.gfile.GFile(path, 'r') as fid:
+  with open(path, 'r') as fid:
     label_map_string = fid.read()
     label_map = string_int_label_map_pb2.StringIntLabelMap()
     try:
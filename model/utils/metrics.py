@@ -0,0 +1,180 @@
+"""In-process counters, gauges and histograms rendered in the Prometheus text format.
+
+Metrics are per process; under gunicorn every worker keeps and serves its own.
+Recording is a dict lookup, a bisect and a few additions under a lock, cheap
+enough for every stage of every request.
+"""
+import bisect
+import contextlib
+import threading
+import time
+
+# Request and stage latencies, in seconds
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for name, value in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(object):
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append('{}{} {}'.format(self.name, _label_text(self.labelnames, labels), _number(value)))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. requests served."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, set directly or read from a callback at scrape time."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super(Gauge, self).__init__(name, documentation, labelnames)
+        self._function = function
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        if self._function is not None:
+            try:
+                self.set(self._function())
+            except Exception as e:
+                print("Gauge {} failed: {!r}".format(self.name, e))
+        return super(Gauge, self).render()
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, plus their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, labels=()):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._values.items())
+        names = self.labelnames + ('le',)
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name, _label_text(names, labels + (_number(bound),)), cumulative))
+            label_text = _label_text(self.labelnames, labels)
+            lines.append('{}_sum{} {}'.format(self.name, label_text, _number(series[-1])))
+            lines.append('{}_count{} {}'.format(self.name, label_text, cumulative))
+        return lines
+
+
+# Metrics of the /predict path
+STAGE_SECONDS = Histogram('paintshop_stage_seconds', 'Time spent in each stage of a prediction.', ('stage',))
+S4_CALL_SECONDS = Histogram('paintshop_s4_call_seconds', 'Duration of S4 calls by kind.', ('kind',))
+S4_CALL_ERRORS = Counter('paintshop_s4_call_errors_total', 'S4 calls that raised, by kind.', ('kind',))
+REQUEST_SECONDS = Histogram('paintshop_request_seconds', 'HTTP request duration by endpoint.', ('endpoint',))
+REQUESTS = Counter('paintshop_requests_total', 'HTTP requests by endpoint and status code.', ('endpoint', 'code'))
+REQUEST_ERRORS = Counter('paintshop_request_errors_total', 'HTTP requests answered with a 5xx, by endpoint.', ('endpoint',))
+IN_FLIGHT = Gauge('paintshop_requests_in_flight', 'HTTP requests being handled.')
+
+
+def timed(stage):
+    """Context manager recording the time spent in `stage` of a prediction."""
+    return STAGE_SECONDS.time((stage,))
+
+
+def timed_call(kind, call):
+    """Wraps an S4 call so its duration and failures are recorded under `kind`."""
+    def wrapper(*args):
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        except Exception:
+            S4_CALL_ERRORS.inc(labels=(kind,))
+            raise
+        finally:
+            S4_CALL_SECONDS.observe(time.perf_counter() - start, (kind,))
+    return wrapper
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,60 @@
+import collections
+import threading
+import time
+
+
+class TTLCache(object):
+    """Thread-safe cache whose entries expire after `ttl` seconds.
+
+    At most `maxsize` entries are kept, the least recently used one is evicted
+    first. Values are produced by the loader passed to `get` on a miss or after
+    expiry; hits, misses and evictions are counted for `stats`.
+    """
+
+    def __init__(self, maxsize=128, ttl=3600.0, timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key, loader):
+        now = self._timer()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+
+        # Load outside the lock, a slow backend call must not block the hits
+        value = loader()
+
+        with self._lock:
+            self._data[key] = (now + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(float(self._hits) / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+            }
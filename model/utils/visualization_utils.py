@@ -8,14 +8,12 @@ The functions do not return a value, instead they modify the image itself.
 # Imports
 import collections
 import functools
-import matplotlib.pyplot as plt
 import numpy as np
 import PIL.Image as Image
-import PIL.ImageColor as ImageColor
 import PIL.ImageDraw as ImageDraw
 import PIL.ImageFont as ImageFont
-import six
 import os
+import time
 
 
 # string utils - import
@@ -195,6 +193,166 @@ def draw_bounding_box_on_image(current_frame_number,image,
     return is_vehicle_detected, csv_line, update_csv
 
 
+@functools.lru_cache(maxsize=None)
+def _label_font():
+  try:
+    return ImageFont.truetype('arial.ttf', 16)
+  except IOError:
+    return ImageFont.load_default()
+
+
+def _text_size(font, text):
+  # Pillow 10 dropped getsize in favour of getbbox.
+  if hasattr(font, 'getsize'):
+    return font.getsize(text)
+  _, _, right, bottom = font.getbbox(text)
+  return right, bottom
+
+
+@functools.lru_cache(maxsize=256)
+def _label_sprite(display_str, color):
+  """Renders the filled label rectangle with its text once per (string, color).
+
+  The sprite covers exactly the rectangle draw_bounding_box_on_image fills,
+  with the text at the same margin, so pasting it gives the same pixels.
+  """
+  font = _label_font()
+  text_width, text_height = _text_size(font, display_str)
+  margin = np.ceil(0.05 * text_height)
+  sprite = Image.new('RGB', (text_width + 1, int(text_height + 2 * margin) + 1), color)
+  ImageDraw.Draw(sprite).text((margin, margin), display_str, fill='black', font=font)
+  return sprite, text_width, text_height, margin
+
+
+def draw_bounding_boxes_on_image_array(image,
+                                       boxes,
+                                       colors,
+                                       display_str_lists,
+                                       thickness=4,
+                                       use_normalized_coordinates=True):
+  """Draws all boxes and their labels onto an image (numpy array) in one pass.
+
+  Produces the same drawing as calling draw_bounding_box_on_image_array once
+  per box, but converts the frame to PIL and back only once, and uses a cached
+  font and cached label sprites.
+
+  Args:
+    image: a numpy array with shape [height, width, 3], modified in place.
+    boxes: a sequence of (ymin, xmin, ymax, xmax) boxes.
+    colors: a color name for each box.
+    display_str_lists: a list of display strings for each box.
+    thickness: line thickness. Default value is 4.
+    use_normalized_coordinates: If True (default), treat coordinates as
+      relative to the image.  Otherwise treat coordinates as absolute.
+
+  Returns:
+    the time spent rendering, in seconds.
+  """
+  start = time.time()
+  image_pil = Image.fromarray(np.uint8(image)).convert('RGB')
+  draw = ImageDraw.Draw(image_pil)
+  im_width, im_height = image_pil.size
+  font = _label_font()
+
+  for (ymin, xmin, ymax, xmax), color, display_str_list in zip(boxes, colors, display_str_lists):
+    if use_normalized_coordinates:
+      (left, right, top, bottom) = (xmin * im_width, xmax * im_width,
+                                    ymin * im_height, ymax * im_height)
+    else:
+      (left, right, top, bottom) = (xmin, xmax, ymin, ymax)
+    draw.line([(left, top), (left, bottom), (right, bottom),
+               (right, top), (left, top)], width=thickness, fill=color)
+
+    if not display_str_list:
+      continue
+
+    # Stack the label above the box, or below it if it would leave the image.
+    display_str_heights = [_text_size(font, ds)[1] for ds in display_str_list]
+    total_display_str_height = (1 + 2 * 0.05) * sum(display_str_heights)
+    if top > total_display_str_height:
+      text_bottom = top
+    else:
+      text_bottom = bottom + total_display_str_height
+
+    # As in draw_bounding_box_on_image only the last string is drawn.
+    display_str = display_str_list[-1]
+    sprite, text_width, text_height, margin = _label_sprite(display_str, color)
+    sprite_top = int(text_bottom) - int(text_height + 2 * margin)
+    if int(text_bottom - text_height - margin) == sprite_top + margin:
+      image_pil.paste(sprite, (int(left), sprite_top))
+    else:
+      # Text cut by the top edge rounds differently, draw it like the per-box path.
+      draw.rectangle(
+          [(left, text_bottom - text_height - 2 * margin), (left + text_width,
+                                                            text_bottom)],
+          fill=color)
+      draw.text(
+          (left + margin, text_bottom - text_height - margin),
+          display_str,
+          fill='black',
+          font=font)
+
+  np.copyto(image, np.array(image_pil))
+  return time.time() - start
+
+
+def visualize_detections_on_image_array(image,
+                                        boxes,
+                                        classes,
+                                        scores,
+                                        category_index,
+                                        color_names=None,
+                                        use_normalized_coordinates=False,
+                                        line_thickness=4):
+  """Overlays already filtered detections on an image in a single pass.
+
+  Labels and colors are the ones visualize_boxes_and_labels_on_single_image_array
+  would produce for the same boxes; no score filtering or counting is done here.
+
+  Args:
+    image: uint8 numpy array with shape (img_height, img_width, 3), modified
+      in place.
+    boxes: a numpy array of shape [N, 4].
+    classes: a numpy array of shape [N] with 1-based class ids.
+    scores: a numpy array of shape [N].
+    category_index: a dict containing category dictionaries keyed by
+      category indices.
+    color_names: optional recognised color name for each box, prefixed to
+      its label.
+    use_normalized_coordinates: whether boxes is to be interpreted as
+      normalized coordinates or not.
+    line_thickness: integer (default: 4) controlling line width of the boxes.
+
+  Returns:
+    the time spent rendering, in seconds.
+  """
+  if color_names is None:
+    color_names = [None] * len(boxes)
+
+  # Group boxes that correspond to the same location, as the per-box path does.
+  box_to_display_str_map = collections.OrderedDict()
+  box_to_color_map = {}
+  for box, class_id, score, color_name in zip(boxes.tolist(), classes.tolist(), scores.tolist(), color_names):
+    box = tuple(box)
+    if class_id in category_index:
+      class_name = category_index[class_id]['name']
+    else:
+      class_name = 'N/A'
+    display_str = '{}: {}%'.format(class_name, int(100 * score))
+    if color_name is not None:
+      display_str = color_name + " " + display_str
+    box_to_display_str_map.setdefault(box, []).append(display_str)
+    box_to_color_map[box] = STANDARD_COLORS[class_id % len(STANDARD_COLORS)]
+
+  return draw_bounding_boxes_on_image_array(
+      image,
+      list(box_to_display_str_map.keys()),
+      [box_to_color_map[box] for box in box_to_display_str_map],
+      list(box_to_display_str_map.values()),
+      thickness=line_thickness,
+      use_normalized_coordinates=use_normalized_coordinates)
+
+
 def visualize_boxes_and_labels_on_single_image_array(current_frame_number,
                                               image,
                                               mode,
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from model import settings
+from model.utils import backbone
+from model.utils import frame_ring
+
+# Startup state reported by /ready
+_state = {'ready': False, 'warmup_seconds': None, 'error': None}
+_done = threading.Event()
+_thread = None
+_thread_lock = threading.Lock()
+
+# Pause between warm-up attempts while the shared inference process is still loading
+_RETRY_INTERVAL = 1.0
+
+def run():
+    # Loads and warms up the detector, then sends one synthetic frame through the
+    # same path /predict uses (batch scheduler or inference process). The shared
+    # inference process may take longer to load its model than a frame may take,
+    # so with it the attempt is repeated until it goes through.
+    start = time.time()
+    while True:
+        try:
+            height, width = settings.INPUT_HEIGHT or 480, settings.INPUT_WIDTH or 640
+            if settings.INFERENCE_SERVER:
+                detection_model = frame_ring.get_client()
+            else:
+                detection_model = backbone.get_batched_model(settings.MODEL_DIR, settings.BATCH_WINDOW_MS, settings.MAX_BATCH_SIZE)
+            detection_model.category_index
+            detection_model.detect(backbone.synthetic_frames(1, height, width)[0])
+        except Exception as e:
+            _state['error'] = repr(e)
+            print("Warm-up failed after {:.2f} s: {!r}".format(time.time() - start, e))
+            # The first outcome is known, wait() need not block on the retries
+            _done.set()
+            if not settings.INFERENCE_SERVER:
+                return
+            time.sleep(_RETRY_INTERVAL)
+        else:
+            _state['warmup_seconds'] = round(time.time() - start, 3)
+            _state['ready'] = True
+            _state['error'] = None
+            print("Warm-up done in {:.2f} s, ready".format(_state['warmup_seconds']))
+            _done.set()
+            return
+
+def start():
+    # Warm up on a background thread, so the web server is up to answer /ready meanwhile
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=run, name='warm-up')
+            _thread.daemon = True
+            _thread.start()
+
+def wait(timeout=None):
+    start()
+    _done.wait(timeout)
+    return _state['ready']
+
+def status():
+    state = dict(_state)
+    if settings.INFERENCE_SERVER:
+        # Ready while the shared inference process serves; its supervisor restarts it if it dies
+        state['ready'] = frame_ring.serving()
+        if state['ready']:
+            state['error'] = None
+        elif state['error'] is None:
+            state['error'] = 'Inference process is not serving.'
+    return state
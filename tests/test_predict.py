@@ -0,0 +1,87 @@
+"""Request validation on /predict, without S4 or a model.
+
+The S4 client modules (model.odata_call, model.get_config) are deployed next
+to the app and are not part of this repository; stand-ins are registered when
+they cannot be imported.
+"""
+import base64
+import importlib
+import os
+import sys
+import types
+import unittest
+
+os.environ.setdefault("OUTBOX", "0")
+os.environ.setdefault("WARMUP_RUNS", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _stand_in(name, **attributes):
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+_stand_in("model.get_config", get_load=lambda name: 1.0, get_consump=lambda name: 1.0,
+          get_material=lambda name: 1)
+_stand_in("model.odata_call", get_load_no=lambda: "0000000001", post_data=lambda *args: None,
+          post_consump=lambda *args: None, post_image=lambda *args: None,
+          material_data=lambda materials: None, check_data=lambda frame, work_order: (frame, frame[:0]))
+
+from model import warmup  # noqa: E402
+
+warmup.start = lambda: None
+
+import app  # noqa: E402
+
+
+class PredictValidationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.app.test_client()
+
+    def test_empty_raw_body_is_bad_request(self):
+        response = self.client.post('/predict', data=b'', content_type='image/jpeg')
+        self.assertEqual(response.status_code, 400)
+
+    def test_base64_of_nothing_is_bad_request(self):
+        response = self.client.post('/predict', json={"image": "b'!!!'"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_garbage_body_is_bad_request(self):
+        response = self.client.post('/predict', data=b'\xff\xd8not a jpeg', content_type='image/jpeg')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejected_upload_reserves_no_load_number(self):
+        reserved = []
+        reserve, app.classify.load_numbers.reserve = app.classify.load_numbers.reserve, lambda: reserved.append(1)
+        try:
+            response = self.client.post('/predict', data=b'not an image', content_type='image/jpeg')
+        finally:
+            app.classify.load_numbers.reserve = reserve
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(reserved, [])
+
+
+class ImageFieldTest(unittest.TestCase):
+
+    def test_bytes_repr_is_read_like_eval(self):
+        # base64.encodebytes wraps lines, so the repr old clients send holds \n escapes
+        encoded = base64.encodebytes(bytes(range(256)))
+        self.assertEqual(base64.b64decode(app.image_field(repr(encoded))), bytes(range(256)))
+
+    def test_bare_base64_is_kept(self):
+        self.assertEqual(app.image_field("bXlpbWFnZQ=="), "bXlpbWFnZQ==")
+
+    def test_non_string_image_is_bad_request(self):
+        client = app.app.test_client()
+        for value in (None, 42, ["abc"], {"b": 1}):
+            response = client.post('/predict', json={"image": value})
+            self.assertEqual(response.status_code, 400, value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Checks that two inference backends detect the same parts on sample images.
+
+Every image goes through both backends, the detections are filtered the way
+the service filters them (DetectionResult, score > .8, first 20 boxes) and
+compared: same classes in the same order and boxes within `--box-tolerance`
+(normalized coordinates). Prints the mean latency of each backend and exits
+with status 1 if any image differs.
+
+  python -m tools.backend_parity --images path/to/images --reference tf --candidate onnx
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from model.api.detection_result import DetectionResult
+from model.utils import backbone
+from model.utils.image_utils import image_codec
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def sample_images(folder):
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            yield name, os.path.join(folder, name)
+
+
+def detect(backend, image):
+    start = time.perf_counter()
+    boxes, scores, classes, num = backend.detect(image)
+    elapsed = time.perf_counter() - start
+    return DetectionResult(image, boxes, scores, classes, backend.category_index), elapsed
+
+
+def compare(reference, candidate, box_tolerance):
+    """Returns a description of the first difference, or None if they agree."""
+    if not np.array_equal(reference.classes, candidate.classes):
+        return "classes {} != {}".format(reference.classes.tolist(), candidate.classes.tolist())
+    if len(reference.boxes):
+        box_error = float(np.abs(reference.boxes - candidate.boxes).max())
+        if box_error > box_tolerance:
+            return "boxes differ by up to {:.4f}".format(box_error)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the detections of two inference backends.")
+    parser.add_argument("--images", required=True, help="folder of sample images")
+    parser.add_argument("--model", default="./model/inference_graph", help="model directory")
+    parser.add_argument("--reference", default="tf", choices=sorted(backbone.BACKENDS))
+    parser.add_argument("--candidate", default="onnx", choices=sorted(backbone.BACKENDS))
+    parser.add_argument("--box-tolerance", type=float, default=0.01)
+    args = parser.parse_args()
+
+    reference = backbone.get_model(args.model, args.reference)
+    candidate = backbone.get_model(args.model, args.candidate)
+
+    latencies = {args.reference: [], args.candidate: []}
+    images, mismatches = 0, 0
+    for name, path in sample_images(args.images):
+        with open(path, 'rb') as f:
+            image = image_codec.decode_image(f.read())
+        expected, reference_time = detect(reference, image)
+        actual, candidate_time = detect(candidate, image)
+        latencies[args.reference].append(reference_time)
+        latencies[args.candidate].append(candidate_time)
+        images += 1
+
+        difference = compare(expected, actual, args.box_tolerance)
+        if difference is not None:
+            mismatches += 1
+            print("MISMATCH {}: {}".format(name, difference))
+
+    if not images:
+        sys.exit("No images found in {}".format(args.images))
+
+    for backend in (args.reference, args.candidate):
+        print("{:>6}: {:7.1f} ms/image".format(backend, 1000 * np.mean(latencies[backend])))
+    print("{} of {} images agree".format(images - mismatches, images))
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Builds optimized variants of the frozen detector and reports how they compare.
+
+  python -m tools.optimize_graph build [--model ./model/inference_graph] [--max-detections 20]
+  python -m tools.optimize_graph report --images path/to/images [--variants "" optimized int8]
+
+`build` writes next to frozen_inference_graph.pb:
+
+  frozen_inference_graph.optimized.pb  final NMS capped at --max-detections,
+                                       nodes the four detection outputs do not
+                                       need stripped, constants and batch norms
+                                       folded
+  frozen_inference_graph.int8.pb       the optimized graph with its weights
+                                       quantized to 8 bit (dequantized at load)
+  frozen_inference_graph.int8.onnx     frozen_inference_graph.onnx, if present,
+                                       dynamically INT8 quantized by ONNX Runtime
+
+The service serves a variant with MODEL_VARIANT=optimized or MODEL_VARIANT=int8
+(for the onnx backend, convert the optimized graph with tf2onnx the same way as
+the original to get frozen_inference_graph.optimized.onnx).
+
+`report` runs every variant in a fresh process over a folder of images and
+prints the mean and p95 latency, the peak memory the model added and how often
+its per-class counts agree with the first variant given (the original by
+default).
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+INPUTS = ['image_tensor']
+OUTPUTS = ['detection_boxes', 'detection_scores', 'detection_classes', 'num_detections']
+
+# Graph Transform Tool passes for a frozen object detection graph
+TRANSFORMS = [
+    'strip_unused_nodes(type=uint8, shape="-1,-1,-1,3")',
+    'remove_nodes(op=Identity, op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'fold_old_batch_norms',
+    'sort_by_execution_order',
+]
+QUANTIZE = ['quantize_weights(minimum_size=1024)']
+
+# Name scopes of the final NMS: two-stage models (Faster R-CNN) and single-stage ones (SSD)
+POSTPROCESSOR_SCOPES = ('SecondStagePostprocessor/', 'Postprocessor/')
+
+
+def cap_max_detections(graph_def, max_detections, scopes=POSTPROCESSOR_SCOPES):
+    """Lowers the final postprocessor's detection limits to at most `max_detections`.
+
+    Object Detection API graphs do not feed max_size_per_class / max_total_size
+    to the NMS op as a Const: they go through tf.minimum(limit, num_boxes)
+    first. So every integer scalar Const inside one of `scopes` that is the
+    max_output_size of an NMS op or an input of a Minimum op is capped. Only the
+    final postprocessor is touched; a two-stage model's proposal NMS (under
+    FirstStage*) keeps its limit, as fewer proposals change the detections.
+
+    The service only looks at the 20 highest scoring boxes, and greedy NMS keeps
+    the same first boxes whatever its limit. Each capped input gets its own copy
+    of the constant, so other users of it (e.g. the output padding) keep their
+    value.
+
+    Returns:
+      the names of the ops whose limit was capped.
+    """
+    import tensorflow as tf
+    from tensorflow.python.framework import tensor_util
+
+    nodes = dict((node.name, node) for node in graph_def.node)
+    capped, limits = [], []
+    for node in graph_def.node:
+        if not node.name.startswith(tuple(scopes)):
+            continue
+        if node.op.startswith('NonMaxSuppression'):
+            positions = [2] if len(node.input) > 2 else []
+        elif node.op == 'Minimum':
+            positions = [0, 1]
+        else:
+            continue
+
+        for position in positions:
+            const = nodes.get(node.input[position].split(':')[0])
+            if const is None or const.op != 'Const':
+                continue
+            value = tensor_util.MakeNdarray(const.attr['value'].tensor)
+            if value.size != 1 or value.dtype.kind not in 'iu' or value.item() <= max_detections:
+                continue
+
+            # A copy keeps the control inputs that put it in the op's loop frame
+            limit = tf.NodeDef()
+            limit.CopyFrom(const)
+            limit.name = '{}/limit_{}_capped'.format(node.name, position)
+            limit.attr['value'].tensor.CopyFrom(
+                tensor_util.make_tensor_proto(np.array(max_detections, dtype=value.dtype)))
+            node.input[position] = limit.name
+            limits.append(limit)
+            capped.append(node.name)
+
+    graph_def.node.extend(limits)
+    return capped
+
+
+def read_graph(path):
+    import tensorflow as tf
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(path, 'rb') as fid:
+        graph_def.ParseFromString(fid.read())
+    return graph_def
+
+
+def write_graph(graph_def, path):
+    import tensorflow as tf
+    with tf.gfile.GFile(path, 'wb') as fid:
+        fid.write(graph_def.SerializeToString())
+    print("Wrote {} ({} nodes, {:.1f} MB)".format(path, len(graph_def.node), os.path.getsize(path) / 1e6))
+
+
+def build(args):
+    from tensorflow.tools.graph_transforms import TransformGraph
+    from model.utils.backbone import model_file
+
+    graph_def = read_graph(model_file(args.model, '.pb', ''))
+    print("Original graph: {} nodes".format(len(graph_def.node)))
+
+    capped = cap_max_detections(graph_def, args.max_detections)
+    if not capped:
+        sys.exit("No detection limit above {} found under {}, nothing to cap".format(
+            args.max_detections, ', '.join(POSTPROCESSOR_SCOPES)))
+    print("Capped {} detection limits at {}:".format(len(capped), args.max_detections))
+    for name in capped:
+        print("  " + name)
+    optimized = TransformGraph(graph_def, INPUTS, OUTPUTS, TRANSFORMS)
+    write_graph(optimized, model_file(args.model, '.pb', 'optimized'))
+
+    quantized = TransformGraph(optimized, INPUTS, OUTPUTS, QUANTIZE)
+    write_graph(quantized, model_file(args.model, '.pb', 'int8'))
+
+    onnx_path = model_file(args.model, '.onnx', '')
+    if os.path.exists(onnx_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(onnx_path, model_file(args.model, '.onnx', 'int8'), weight_type=QuantType.QUInt8)
+        print("Wrote {}".format(model_file(args.model, '.onnx', 'int8')))
+    else:
+        print("No {}, skipping ONNX quantization".format(onnx_path))
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def measure_variant(model, backend, variant, image_paths):
+    """Runs in its own process: latencies, peak memory and per-image class counts of one variant."""
+    from model.api.detection_result import DetectionResult
+    from model.utils import backbone
+    from model.utils.image_utils import image_codec
+
+    images = []
+    for path in image_paths:
+        with open(path, 'rb') as f:
+            images.append(image_codec.decode_image(f.read()))
+    baseline = _max_rss_mb()
+
+    detection_model = backbone.BACKENDS[backend](model, variant)
+    detection_model.warm_up()
+
+    latencies, counts = [], []
+    for image in images:
+        start = time.perf_counter()
+        boxes, scores, classes, num = detection_model.detect(image)
+        latencies.append(time.perf_counter() - start)
+        counts.append(DetectionResult(image, boxes, scores, classes, detection_model.category_index).class_counts)
+
+    return {
+        'latencies': latencies,
+        'memory_mb': _max_rss_mb() - baseline,
+        'counts': np.array(counts),
+        'classes': dict((class_id, category['name']) for class_id, category in detection_model.category_index.items()),
+    }
+
+
+def report(args):
+    image_paths = [os.path.join(args.images, name) for name in sorted(os.listdir(args.images))
+                   if name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))]
+    if not image_paths:
+        sys.exit("No images found in {}".format(args.images))
+
+    # A fresh process per variant, so one variant's memory does not count towards the next
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for variant in args.variants:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(measure_variant, (args.model, args.backend, variant, image_paths)))
+
+    reference = results[0]['counts']
+    print("{} images, {} backend, agreement against variant '{}'\n".format(len(image_paths), args.backend, args.variants[0]))
+    print("{:<12} {:>10} {:>10} {:>11} {:>10}".format('variant', 'mean ms', 'p95 ms', 'memory MB', 'agreement'))
+    for variant, result in zip(args.variants, results):
+        latencies = 1000 * np.array(result['latencies'])
+        agreement = np.mean(np.all(result['counts'] == reference, axis=1))
+        print("{:<12} {:>10.1f} {:>10.1f} {:>11.0f} {:>9.1f}%".format(
+            variant or 'original', latencies.mean(), np.percentile(latencies, 95), result['memory_mb'], 100 * agreement))
+
+    print("\nPer-class count agreement:")
+    for class_id, name in sorted(results[0]['classes'].items()):
+        cells = ["{:.1f}%".format(100 * np.mean(result['counts'][:, class_id] == reference[:, class_id]))
+                 for result in results]
+        print("  {:<20} {}".format(name, '  '.join(cells)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Optimize the frozen detection graph and compare the variants.")
+    parser.add_argument("--model", default="./model/inference_graph", help="model directory")
+    commands = parser.add_subparsers(dest="command")
+
+    build_parser = commands.add_parser("build", help="write the optimized and int8 variants")
+    build_parser.add_argument("--max-detections", type=int, default=20,
+                              help="NMS output cap, at least the max_boxes the service draws")
+
+    report_parser = commands.add_parser("report", help="latency, memory and count agreement of variants")
+    report_parser.add_argument("--images", required=True, help="folder of sample images")
+    report_parser.add_argument("--backend", default="tf", help="inference backend, see backbone.BACKENDS")
+    report_parser.add_argument("--variants", nargs="+", default=["", "optimized", "int8"],
+                               help="variants to compare, the first one is the reference")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build(args)
+    elif args.command == "report":
+        report(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()